@@ -0,0 +1,165 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# columns of a player's match stats, in the order of the playermatch table
+MatchFields = ('match_id', 'hero_id', 'kills', 'deaths', 'assists', 'wins', 'losses', 'gold', 'wards', 'duration')
+
+# sums per hero, kdr etc. are derived from them
+HeroSums = ('use', 'k', 'd', 'a', 'wins', 'losses', 'gold', 'wards', 'playedtime')
+HeroSortKeys = ('use', 'kdr', 'k', 'd', 'a', 'kpg', 'dpg', 'apg', 'gpm', 'wpg', 'wins', 'losses', 'wlr',
+                'perc', 'gold', 'wards')
+
+# per match columns of the matches output that are averaged
+AverageFields = ('gd', 'k', 'd', 'a', 'wa', 'ck', 'cd', 'gpm')
+
+
+class Columns(object):
+    """Stats of many matches stored by column, as numpy arrays if numpy is installed, else as lists"""
+
+    def __init__(self, fields, rows):
+        rows = list(rows)
+        self.fields = fields
+        self.length = len(rows)
+        columns = list(zip(*rows)) if rows else [()] * len(fields)
+        if numpy is not None:
+            self.columns = {field: numpy.array(column, dtype=numpy.int64) for field, column in zip(fields, columns)}
+        else:
+            self.columns = {field: list(column) for field, column in zip(fields, columns)}
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+
+def averages(columns, count):
+    """Averages of the matches output over count matches, count includes matches that couldn't be loaded.
+
+       Returns:
+         dict with the averaged AverageFields, kdr of the averages and gd as duration string
+    """
+    count = max(count, 1)
+    if numpy is not None:
+        sums = {field: int(columns[field].sum()) for field in AverageFields}
+    else:
+        sums = {field: sum(columns[field]) for field in AverageFields}
+    avg = {field: int(sums[field] / count) for field in AverageFields}
+    avg['gd'] = str(datetime.timedelta(seconds=sums['gd']) / count)[:4]
+    avg['kdr'] = avg['k'] / avg['d'] if avg['d'] else float(avg['k'])
+    return avg
+
+
+def herostats(columns, total, sortby='use', order='asc'):
+    """Groups a player's match stats by hero and derives kdr, per game, gpm and win stats.
+       Heroes with the same sort value are ordered by the last match played with them, newest first.
+
+       Args:
+         columns: Columns with MatchFields
+         total: number of matches the use percentage is relative to
+         sortby: one of HeroSortKeys
+
+       Returns:
+         list of dicts per hero, keys are heroid, HeroSums and the derived stats
+    """
+    if sortby not in HeroSortKeys:
+        raise ValueError("Unknown sort key: " + sortby)
+    if not len(columns):
+        return []
+    if numpy is not None:
+        return _herostatsnumpy(columns, total, sortby, order)
+    return _herostatspython(columns, total, sortby, order)
+
+
+def _herostatsnumpy(columns, total, sortby, order):
+    heroids, groups = numpy.unique(columns['hero_id'], return_inverse=True)
+    size = len(heroids)
+
+    def groupsum(field):
+        sums = numpy.zeros(size, dtype=numpy.int64)
+        numpy.add.at(sums, groups, columns[field])
+        return sums
+
+    stats = {'use': numpy.bincount(groups, minlength=size).astype(numpy.int64),
+             'k': groupsum('kills'), 'd': groupsum('deaths'), 'a': groupsum('assists'),
+             'wins': groupsum('wins'), 'losses': groupsum('losses'), 'gold': groupsum('gold'),
+             'wards': groupsum('wards'), 'playedtime': groupsum('duration')}
+    lastmatch = numpy.zeros(size, dtype=numpy.int64)
+    numpy.maximum.at(lastmatch, groups, columns['match_id'])
+
+    use = stats['use']
+    stats['perc'] = (use / total * 100).astype(numpy.int64)
+    stats['kdr'] = numpy.where(stats['d'] > 0, stats['k'] / numpy.maximum(stats['d'], 1), stats['k'])
+    stats['kpg'] = stats['k'] / use
+    stats['dpg'] = stats['d'] / use
+    stats['apg'] = stats['a'] / use
+    stats['wpg'] = stats['wards'] / use
+    playedtime = numpy.where(stats['playedtime'] != 0, stats['playedtime'], 1)
+    stats['gpm'] = (stats['gold'] / (playedtime / 60.0)).astype(numpy.int64)
+    stats['wlr'] = numpy.where(stats['losses'] > 0, stats['wins'] / numpy.maximum(stats['losses'], 1),
+                               stats['wins'])
+
+    # lexsort sorts by the last key first
+    key = stats[sortby]
+    indexes = numpy.lexsort((-lastmatch, -key if order == 'desc' else key))
+    stats['heroid'] = heroids
+    lists = {name: values[indexes].tolist() for name, values in stats.items()}
+    return [{name: lists[name][i] for name in lists} for i in range(size)]
+
+
+def _herostatspython(columns, total, sortby, order):
+    heroes = {}
+    lastmatch = {}
+    for i, heroid in enumerate(columns['hero_id']):
+        sums = heroes.get(heroid)
+        if sums is None:
+            sums = heroes[heroid] = dict.fromkeys(HeroSums, 0)
+            lastmatch[heroid] = 0
+        sums['use'] += 1
+        sums['k'] += columns['kills'][i]
+        sums['d'] += columns['deaths'][i]
+        sums['a'] += columns['assists'][i]
+        sums['wins'] += columns['wins'][i]
+        sums['losses'] += columns['losses'][i]
+        sums['gold'] += columns['gold'][i]
+        sums['wards'] += columns['wards'][i]
+        sums['playedtime'] += columns['duration'][i]
+        lastmatch[heroid] = max(lastmatch[heroid], columns['match_id'][i])
+
+    result = []
+    for heroid, stats in heroes.items():
+        use = stats['use']
+        stats['heroid'] = heroid
+        stats['perc'] = int(use / total * 100)
+        stats['kdr'] = stats['k'] / stats['d'] if stats['d'] > 0 else stats['k']
+        stats['kpg'] = stats['k'] / use
+        stats['dpg'] = stats['d'] / use
+        stats['apg'] = stats['a'] / use
+        stats['wpg'] = stats['wards'] / use
+        stats['gpm'] = int(stats['gold'] / ((stats['playedtime'] if stats['playedtime'] != 0 else 1) / 60.0))
+        stats['wlr'] = stats['wins'] / stats['losses'] if stats['losses'] > 0 else stats['wins']
+        result.append(stats)
+
+    sign = -1 if order == 'desc' else 1
+    result.sort(key=lambda stats: (sign * stats[sortby], -lastmatch[stats['heroid']]))
+    return result
@@ -0,0 +1,150 @@
+"""
+Append-only archive of matches in one memory mapped file.
+
+Every record is a small header with the match id and the length of the
+encoded match, followed by the match in the matchcodec format (or the
+zlib compressed json of DbMatchStore if it doesn't fit). A second file
+with the extension .idx holds (match id, offset, length) of every record,
+so opening the archive doesn't read the matches. Records are never
+changed and a match that is already archived isn't appended again.
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import mmap
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from matchstore import DbMatchStore
+
+RecordHeader = struct.Struct('<qI')
+IndexEntry = struct.Struct('<qQI')
+
+
+class MatchArchive(object):
+    """Match store in an append-only file, matches are decoded straight from the memory map.
+       Other processes may append to the same archive, their matches are seen after refresh."""
+
+    def __init__(self, path):
+        self.path = path
+        self.indexpath = path + '.idx'
+        # match id to (offset, length) of the encoded match
+        self.index = {}
+        self.indexsize = 0
+        # end of the last indexed record
+        self.end = 0
+        self.mm = None
+        self.mapped = 0
+        self.lock = threading.Lock()
+        open(self.path, 'ab').close()
+        self.refresh()
+
+    def refresh(self):
+        """Reads the index entries and records other processes appended and maps the whole file"""
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        with open(self.indexpath, 'ab+') as f:
+            f.seek(self.indexsize)
+            data = f.read()
+        entries = len(data) // IndexEntry.size
+        self.indexsize += entries * IndexEntry.size
+        for matchid, offset, length in IndexEntry.iter_unpack(data[:entries * IndexEntry.size]):
+            self.index[matchid] = (offset, length)
+            self.end = max(self.end, offset + length)
+
+        size = os.path.getsize(self.path)
+        if size > self.mapped:
+            with open(self.path, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped = len(self.mm)
+        # records written by a writer that didn't get to write their index entries
+        while self.end + RecordHeader.size <= self.mapped:
+            matchid, length = RecordHeader.unpack_from(self.mm, self.end)
+            offset = self.end + RecordHeader.size
+            if offset + length > self.mapped:
+                break
+            self.index[matchid] = (offset, length)
+            self.end = offset + length
+
+    def view(self, matchid):
+        """Returns a memoryview of the encoded match or None if it isn't archived"""
+        entry = self.index.get(matchid)
+        if entry is None:
+            return None
+        offset, length = entry
+        if offset + length > self.mapped:
+            self.refresh()
+        return memoryview(self.mm)[offset:offset + length]
+
+    def cachedids(self, matchids):
+        matchids = list(matchids)
+        cached = set(matchid for matchid in matchids if matchid in self.index)
+        if len(cached) < len(matchids) and os.path.getsize(self.path) > self.end:
+            self.refresh()
+            cached = set(matchid for matchid in matchids if matchid in self.index)
+        return cached
+
+    def load(self, matchid, aid=None):
+        """Returns the match data or None if the match isn't archived.
+           With aid only the stats of that player are decoded, see matchcodec.decodeplayer."""
+        blob = self.view(matchid)
+        if blob is None:
+            return None
+        return DbMatchStore.decode(blob, aid)
+
+    def storemany(self, matches):
+        records = [(matchid, DbMatchStore.encode(matchdata, compact=True)) for matchid, matchdata in matches.items()]
+        if not records:
+            return
+        with self.lock, open(self.path, 'ab') as f:
+            # the lock keeps the records of processes appending at the same time apart
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # another process may have stored some of the matches meanwhile
+                self._refresh()
+                records = [(matchid, blob) for matchid, blob in records if matchid not in self.index]
+                offset = f.seek(0, os.SEEK_END)
+                entries = []
+                for matchid, blob in records:
+                    f.write(RecordHeader.pack(matchid, len(blob)))
+                    f.write(blob)
+                    offset += RecordHeader.size
+                    entries.append((matchid, offset, len(blob)))
+                    offset += len(blob)
+                f.flush()
+                with open(self.indexpath, 'ab') as indexf:
+                    indexf.write(b''.join(IndexEntry.pack(*entry) for entry in entries))
+                self._refresh()
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        """Yields (matchid, matchdata) of all archived matches in the order they are stored in the file"""
+        self.refresh()
+        for offset, matchid in sorted((offset, matchid) for matchid, (offset, length) in self.index.items()):
+            yield matchid, self.load(matchid)
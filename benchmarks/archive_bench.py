@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark of reading every cached match from the match stores
+
+Stores generated matches in the gzip json file cache, the compact file
+cache, the match database and the match archive, then reads all of them
+back, once whole and once only the stats of one player like the matches
+output does, run with: python3 benchmarks/archive_bench.py -n 10000
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+from archive import MatchArchive
+from matchstore import FileMatchStore, DbMatchStore
+from datetimeutil import epoch
+from bench_commands import FIRSTMATCH, PLAYERID, matchresponses
+
+
+def stores(tmpdir):
+    db = sqlite3.connect(os.path.join(tmpdir, 'stats.db'))
+    return [('files json', FileMatchStore(os.path.join(tmpdir, 'json'))),
+            ('files compact', FileMatchStore(os.path.join(tmpdir, 'compact'), compact=True)),
+            ('db compact', DbMatchStore(lambda: db, compact=True)),
+            ('archive', MatchArchive(os.path.join(tmpdir, 'matches.hsa')))]
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark reading all matches from the match stores')
+    parser.add_argument('-n', '--number', type=int, default=10000, help='number of matches')
+    parser.add_argument('--dir', help='directory to create the stores in')
+    args = parser.parse_args()
+
+    rand = random.Random(args.number)
+    matches = {}
+    for matchid in range(FIRSTMATCH, FIRSTMATCH + args.number):
+        summ, allstats = matchresponses(matchid, rand)
+        summ[0]['mdt_epoch'] = epoch(summ[0]['mdt'])
+        # combined like HttpDataProvider.downloadmatch does
+        matches[matchid] = summ + [allstats[0][0], allstats[1], allstats[2]]
+    matchids = list(matches)
+
+    print("{store:14s} {whole:>10s} {player:>10s}".format(store='store', whole='whole', player='player'))
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+        for name, store in stores(tmpdir):
+            store.storemany(matches)
+            whole = timed(lambda: [store.load(matchid) for matchid in matchids])
+            player = timed(lambda: [store.load(matchid, aid=PLAYERID) for matchid in matchids])
+            print("{store:14s} {whole:8.0f}ms {player:8.0f}ms".format(store=name, whole=whole * 1000,
+                                                                     player=player * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Benchmarks every honstats command against synthetic match histories
+
+Generates recorded API responses for a player with 100, 1000 and 10000
+matches, then runs the Text and Html output of every command with a
+FileDataProvider on an empty cache (cold) and again on the filled cache
+(warm). Reports wall time, API requests, cache hit ratio and peak memory,
+run with: python3 benchmarks/bench_commands.py --json results.json
+
+The peak memory is measured with tracemalloc in a separate warm run, so
+it doesn't distort the timings.
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+import text
+import html
+from provider import FileDataProvider
+
+PLAYER = 'benchplayer'
+PLAYERID = 1000
+PLAYERS = 100
+HEROES = 60
+FIRSTMATCH = 120000000
+STATSTYPES = {'ranked': 'rnk', 'public': 'acc', 'casual': 'cs'}
+
+# name, output method and its arguments, matchids are the match ids of the corpus
+COMMANDS = [
+    ('player', lambda out, matchids: out.playerinfo([PLAYER], 'ranked')),
+    ('matches', lambda out, matchids: out.matchesinfo([PLAYER], 'ranked', None)),
+    ('match', lambda out, matchids: out.matchinfo(matchids[:20])),
+    ('player-heroes', lambda out, matchids: out.playerheroesinfo([PLAYER], 'ranked', 'use', 'desc', None)),
+    ('lastmatches', lambda out, matchids: out.lastmatchesinfo([PLAYER], 'ranked', 'hero 7', None, 5)),
+    ('heroes', lambda out, matchids: out.heroesinfo(None)),
+]
+OUTPUTS = {'text': text.Text, 'html': html.Html}
+
+
+def nick(aid):
+    return PLAYER if aid == PLAYERID else 'player{id}'.format(id=aid)
+
+
+def writejson(datadir, path, data):
+    filepath = os.path.join(datadir, *path.split('/'))
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+
+
+def playerstats(aid, rand):
+    data = {'account_id': str(aid), 'nickname': nick(aid), 'acc_pub_skill': str(rand.randint(1200, 2000))}
+    for prefix in STATSTYPES.values():
+        played = rand.randint(100, 1000)
+        wins = rand.randint(0, played)
+        data.update({prefix + '_games_played': str(played),
+                     prefix + '_wins': str(wins),
+                     prefix + '_losses': str(played - wins),
+                     prefix + '_amm_team_rating': str(rand.uniform(1200, 2000)),
+                     prefix + '_herokills': str(rand.randint(1, 10 * played)),
+                     prefix + '_deaths': str(rand.randint(1, 10 * played)),
+                     prefix + '_heroassists': str(rand.randint(1, 10 * played)),
+                     prefix + '_wards': str(rand.randint(0, 3 * played)),
+                     prefix + '_denies': str(rand.randint(0, 20 * played))})
+    return data
+
+
+def matchresponses(matchid, rand):
+    """Returns the /match/summ and /match/all responses of a match the benchmark player played in"""
+    players = [PLAYERID] + rand.sample(range(PLAYERID + 1, PLAYERID + PLAYERS), 9)
+    rand.shuffle(players)
+    legionwins = rand.random() > 0.5
+    duration = rand.randint(1200, 3600)
+    stats = []
+    for i, aid in enumerate(players):
+        team = 1 if i < 5 else 2
+        win = (team == 1) == legionwins
+        stats.append({'match_id': str(matchid), 'account_id': str(aid), 'hero_id': str(rand.randint(1, HEROES)),
+                      'team': str(team), 'level': str(rand.randint(5, 25)),
+                      'wins': str(int(win)), 'losses': str(int(not win)),
+                      'herokills': str(rand.randint(0, 20)), 'deaths': str(rand.randint(0, 15)),
+                      'heroassists': str(rand.randint(0, 25)), 'teamcreepkills': str(rand.randint(0, 200)),
+                      'neutralcreepkills': str(rand.randint(0, 50)), 'denies': str(rand.randint(0, 30)),
+                      'wards': str(rand.randint(0, 10)), 'gold': str(rand.randint(3000, 20000)),
+                      'goldlost2death': str(rand.randint(0, 2000)), 'secs': str(duration)})
+    date = datetime(2013, 1, 1) + timedelta(seconds=(matchid - FIRSTMATCH) * 600)
+    summ = [{'match_id': str(matchid), 'mdt': date.strftime('%Y-%m-%d %H:%M:%S'), 'time_played': str(duration)}]
+    settings = [{'match_id': str(matchid), 'ap': '0', 'ar': str(rand.randint(0, 1))}]
+    items = [{'account_id': str(aid), 'match_id': str(matchid)} for aid in players]
+    return summ, [settings, items, stats]
+
+
+def writecorpus(datadir, matches):
+    """Writes the API responses of a player with `matches` matches into datadir, returns the match ids"""
+    rand = random.Random(matches)
+    for aid in range(PLAYERID, PLAYERID + PLAYERS):
+        data = playerstats(aid, rand)
+        for statstype in STATSTYPES:
+            writejson(datadir, 'player_statistics/{type}/nickname/{nick}'.format(type=statstype, nick=nick(aid)),
+                      data)
+
+    matchids = [FIRSTMATCH + i for i in range(matches)]
+    for matchid in matchids:
+        summ, allstats = matchresponses(matchid, rand)
+        writejson(datadir, 'match/summ/matchid/{id}'.format(id=matchid), summ)
+        writejson(datadir, 'match/all/matchid/{id}'.format(id=matchid), allstats)
+
+    history = ','.join('{id}|2|01/01/2013'.format(id=matchid) for matchid in matchids)
+    for statstype in STATSTYPES:
+        writejson(datadir, 'match_history/{type}/nickname/{nick}'.format(type=statstype, nick=PLAYER),
+                  [{'account_id': str(PLAYERID), 'history': history}])
+
+    writejson(datadir, 'heroes/all', {str(i): {'hero_id': str(i), 'disp_name': 'Hero {id}'.format(id=i),
+                                               'cli_name': 'Hero_{id}'.format(id=i)}
+                                      for i in range(1, HEROES + 1)})
+    return sorted(matchids, reverse=True)
+
+
+def cachestats(dp):
+    caches = (dp.nicks, dp.ids, dp.heronames)
+    return {'requests': dp.counters['requests'],
+            'matchhits': dp.counters['matchcache_hits'],
+            'matchmisses': dp.counters['matchcache_misses'],
+            'lookuphits': sum(cache.hits for cache in caches),
+            'lookupmisses': sum(cache.misses for cache in caches)}
+
+
+def run(dp, output, command, matchids, trace=False):
+    """Consumes the output of command, returns the measurements"""
+    before = cachestats(dp)
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in command(output, matchids))
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    after = cachestats(dp)
+    diff = {key: after[key] - before[key] for key in after}
+    hits = diff['matchhits'] + diff['lookuphits']
+    lookups = hits + diff['matchmisses'] + diff['lookupmisses']
+    return {'seconds': elapsed,
+            'requests': diff['requests'],
+            'hitratio': hits / lookups if lookups else None,
+            'peakbytes': peak,
+            'outputbytes': size}
+
+
+def bench(datadir, matchids, names, outputs, args):
+    results = []
+    for name, command in COMMANDS:
+        if name not in names:
+            continue
+        for outputname in outputs:
+            with tempfile.TemporaryDirectory() as cachedir:
+                dp = FileDataProvider(datadir, latency=args.latency, cachedir=cachedir, workers=args.workers,
+                                      matchstore=args.matchstore, matchformat=args.matchformat)
+                output = OUTPUTS[outputname](dp)
+                cold = run(dp, output, command, matchids)
+                warm = run(dp, output, command, matchids)
+                traced = run(dp, output, command, matchids, trace=not args.no_memory)
+                warm['peakbytes'] = traced['peakbytes']
+                results.append({'command': name, 'output': outputname, 'matches': len(matchids),
+                                'cold': cold, 'warm': warm})
+                del dp
+    return results
+
+
+def printresult(result):
+    for run_ in ('cold', 'warm'):
+        data = result[run_]
+        print("{matches:>6d} {command:14s} {output:5s} {run:5s} {seconds:9.3f}s {requests:7d} {hits:>6s} "
+              "{peak:>9s}".format(matches=result['matches'], command=result['command'], output=result['output'],
+                                  run=run_, seconds=data['seconds'], requests=data['requests'],
+                                  hits='-' if data['hitratio'] is None else '{:.1%}'.format(data['hitratio']),
+                                  peak='-' if data['peakbytes'] is None else
+                                  '{:.1f}MB'.format(data['peakbytes'] / 1024 / 1024)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the honstats commands on synthetic match histories')
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma separated numbers of matches')
+    parser.add_argument('--commands', default=','.join(name for name, command in COMMANDS),
+                        help='comma separated commands to run')
+    parser.add_argument('--outputs', default='text,html', help='comma separated output modes')
+    parser.add_argument('--corpus', help='directory to keep the generated corpora in, they are reused')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every API request is delayed')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='number of concurrent match downloads')
+    parser.add_argument('--matchstore', choices=['files', 'db', 'archive'], default='files', help='match store to use')
+    parser.add_argument('--matchformat', choices=['json', 'compact'], default='json',
+                        help='encoding of the cached matches')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory")
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    names = args.commands.split(',')
+    outputs = args.outputs.split(',')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpusdir = os.path.abspath(os.path.expanduser(args.corpus)) if args.corpus else tmpdir
+        print("{matches:>6s} {command:14s} {output:5s} {run:5s} {seconds:>10s} {requests:>7s} {hits:>6s} "
+              "{peak:>9s}".format(matches='size', command='command', output='out', run='cache', seconds='time',
+                                  requests='API', hits='hit%', peak='peak mem'))
+        results = []
+        for size in (int(size) for size in args.sizes.split(',')):
+            datadir = os.path.join(corpusdir, 'matches{size}'.format(size=size))
+            if os.path.isdir(datadir):
+                matchids = [FIRSTMATCH + i for i in range(size)][::-1]
+            else:
+                matchids = writecorpus(datadir, size)
+            for result in bench(datadir, matchids, names, outputs, args):
+                printresult(result)
+                results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'date': datetime.now().isoformat(), 'matchstore': args.matchstore,
+                       'matchformat': args.matchformat, 'workers': args.workers,
+                       'latency': args.latency, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
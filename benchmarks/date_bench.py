@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Micro benchmark for the match date handling of datetimeutil
+
+Formats the dates of a generated history the way Match.gamedatestr did
+before (strptime and a mktime/localtime DST check per call) and with the
+sliced parser, the memoized DST check and the stored epoch, run with:
+python3 benchmarks/date_bench.py
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta, tzinfo
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+from datetimeutil import STDOFFSET, DSTOFFSET, DSTDIFF, ZERO, epoch, localdatestr
+
+
+class UncachedTimezone(tzinfo):
+    """LocalTimezone before the DST decisions were memoized"""
+
+    def utcoffset(self, dt):
+        return DSTOFFSET if self._isdst(dt) else STDOFFSET
+
+    def dst(self, dt):
+        return DSTDIFF if self._isdst(dt) else ZERO
+
+    def tzname(self, dt):
+        return time.tzname[self._isdst(dt)]
+
+    @classmethod
+    def _isdst(cls, dt):
+        tt = (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.weekday(), 0, 0)
+        return time.localtime(time.mktime(tt)).tm_isdst > 0
+
+Uncached = UncachedTimezone()
+
+
+def olddatestr(datestr):
+    date = datetime.strptime(datestr + " -0400", "%Y-%m-%d %H:%M:%S %z")
+    return date.astimezone(Uncached).isoformat(' ')[:16]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark match date parsing and formatting')
+    parser.add_argument('-n', '--number', type=int, default=10000, help='number of match dates')
+    args = parser.parse_args()
+
+    # one match every 10 minutes, like an active history
+    start = datetime(2013, 1, 1)
+    dates = [(start + timedelta(minutes=10 * i)).strftime('%Y-%m-%d %H:%M:%S') for i in range(args.number)]
+    epochs = [epoch(date) for date in dates]
+
+    timings = {}
+    begin = time.perf_counter()
+    old = [olddatestr(date) for date in dates]
+    timings['strptime'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    parsed = [localdatestr(epoch(date)) for date in dates]
+    timings['sliced'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    stored = [localdatestr(timestamp) for timestamp in epochs]
+    timings['stored epoch'] = time.perf_counter() - begin
+
+    assert old == parsed == stored
+    for name, seconds in timings.items():
+        print("{name:14s} {ms:8.1f} ms {speedup:6.1f}x".format(name=name, ms=seconds * 1000,
+                                                             speedup=timings['strptime'] / seconds))
+
+if __name__ == "__main__":
+    main()
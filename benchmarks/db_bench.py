@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the nickname inserts into stats.db
+
+Learns the nicknames of generated players the way id2nick did before
+(rollback journal, commit after every insert), with WAL but still one
+commit per insert, and through the provider's queued inserts which are
+committed in batches, run with: python3 benchmarks/db_bench.py
+
+The database is created in a temporary directory, use --dir to measure
+the disk the cache really lives on, a tmpfs makes fsyncs almost free.
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+from provider import DBCREATE, HttpDataProvider
+
+FIRSTID = 1000
+
+
+class StubDataProvider(HttpDataProvider):
+    """Answers every player request without a server, so only the database is measured"""
+
+    def fetch(self, path):
+        return {'nickname': 'player' + path.rsplit('/', 1)[-1]}
+
+
+def percommit(dbfile, aids, wal):
+    db = sqlite3.connect(dbfile)
+    if wal:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(DBCREATE)
+    start = time.perf_counter()
+    for aid in aids:
+        db.execute('INSERT OR REPLACE INTO player VALUES( :id, :nick );', {'id': aid, 'nick': 'player' + str(aid)})
+        db.commit()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def queued(cachedir, aids):
+    dp = StubDataProvider(cachedir=cachedir)
+    start = time.perf_counter()
+    for aid in aids:
+        dp.id2nick(aid)
+    dp.flush()
+    elapsed = time.perf_counter() - start
+    dp.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the nickname inserts into stats.db')
+    parser.add_argument('-n', '--number', type=int, default=5000, help='number of nicknames')
+    parser.add_argument('--dir', help='directory to create the databases in')
+    args = parser.parse_args()
+
+    aids = list(range(FIRSTID, FIRSTID + args.number))
+    timings = {}
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+        timings['per row, rollback journal'] = percommit(os.path.join(tmpdir, 'journal.db'), aids, wal=False)
+        timings['per row, WAL'] = percommit(os.path.join(tmpdir, 'wal.db'), aids, wal=True)
+        timings['provider, batched WAL'] = queued(os.path.join(tmpdir, 'provider'), aids)
+
+    base = timings['per row, rollback journal']
+    for name, seconds in timings.items():
+        print("{name:26s} {ms:9.1f} ms {rate:9.0f} rows/s {speedup:6.1f}x".format(
+            name=name, ms=seconds * 1000, rate=len(aids) / seconds, speedup=base / seconds))
+
+if __name__ == "__main__":
+    main()
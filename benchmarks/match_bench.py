@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Micro benchmark for rendering a match with data.Match
+
+Renders the sample match with the indexed Match and with the linear player
+lookup Match used before, run with: python3 benchmarks/match_bench.py
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+from datetime import timedelta
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+from data import Match
+
+SAMPLEDIR = os.path.join(BASEDIR, 'sampledata')
+SAMPLEMATCHID = '112026229'
+SAMPLEMATCH = os.path.join(SAMPLEDIR, 'match', 'all', 'matchid', SAMPLEMATCHID)
+# sampledata only has the recorded /match/all of the sample match, the date of its summary is made up
+SAMPLEDATE = '2013-03-01 21:12:37'
+
+
+class LinearMatch(Match):
+    """Match with the player lookup before players were indexed, scans and converts on every call"""
+    __slots__ = ()
+
+    def players(self, team=None):
+        if team:
+            iteam = 1 if team == "legion" else 2
+            return {int(data['account_id']): data for data in self.data[3] if int(data['team']) == iteam}
+        return {int(data['account_id']): data for data in self.data[3]}
+
+    def playermatchstats(self, id_):
+        for stats in self.data[3]:
+            if int(id_) == int(stats['account_id']):
+                return stats
+        return None
+
+    def playerstat(self, id_, stat):
+        return int(self.playermatchstats(id_)[stat])
+
+    def gameduration(self):
+        return timedelta(seconds=int(self.data[0]['time_played']))
+
+
+class StubProvider(object):
+    def id2nick(self, aid):
+        return str(aid)
+
+    def id2nicks(self, aids):
+        return {aid: str(aid) for aid in aids}
+
+    def heroid2name(self, aid, full=False):
+        return str(aid)
+
+
+def samplesumm(matchstats):
+    """/match/summ response of the sample match, the duration is the longest time a player played"""
+    duration = max(int(stats['secs']) for stats in matchstats[2])
+    return [{'match_id': SAMPLEMATCHID, 'mdt': SAMPLEDATE, 'time_played': str(duration)}]
+
+
+def writesample(datadir):
+    """Copies sampledata to datadir and adds the summary of the sample match the output needs"""
+    shutil.copytree(SAMPLEDIR, datadir, dirs_exist_ok=True)
+    with open(SAMPLEMATCH) as f:
+        matchstats = json.load(f)
+    path = os.path.join(datadir, 'match', 'summ', 'matchid', SAMPLEMATCHID)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(samplesumm(matchstats), f)
+
+
+def loadsample():
+    with open(SAMPLEMATCH) as f:
+        matchstats = json.load(f)
+    matchdata = samplesumm(matchstats)
+    matchdata.append(matchstats[0][0])
+    matchdata.append(matchstats[1])
+    matchdata.append(matchstats[2])
+    return matchdata
+
+
+def bench(matchclass, matchdata, number):
+    dp = StubProvider()
+    aid = int(matchdata[3][0]['account_id'])
+
+    def matchstr():
+        matchclass(matchdata).matchstr(dp)
+
+    def matchesstr():
+        matchclass(matchdata).matchesstr(aid, dp)
+
+    return {'matchstr': min(timeit.repeat(matchstr, number=number, repeat=3)) / number,
+            'matchesstr': min(timeit.repeat(matchesstr, number=number, repeat=3)) / number}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark Match rendering on the sample match')
+    parser.add_argument('-n', '--number', type=int, default=2000, help='renders per measurement')
+    args = parser.parse_args()
+
+    matchdata = loadsample()
+    linear = bench(LinearMatch, matchdata, args.number)
+    indexed = bench(Match, matchdata, args.number)
+    print("{name:12s} {linear:>12s} {indexed:>12s} {speedup:>8s}".format(
+        name='', linear='linear us', indexed='indexed us', speedup='speedup'))
+    for name in linear:
+        print("{name:12s} {linear:12.1f} {indexed:12.1f} {speedup:7.1f}x".format(
+            name=name, linear=linear[name] * 1e6, indexed=indexed[name] * 1e6,
+            speedup=linear[name] / indexed[name]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Connection reuse of httpclient.ConnectionPool against a local API stub
+
+Starts a ReplayServer on the sample data and requests its responses
+through a ConnectionPool, from one thread and from several threads.
+Checks that no more connections are created than the pool holds and
+that every other request reused one, then compares the time with a new
+connection per request, run with: python3 benchmarks/pool_bench.py
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import http.client
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+from httpclient import ConnectionPool
+from replay import ReplayServer
+
+SAMPLEDIR = os.path.join(BASEDIR, 'sampledata')
+# the last one isn't recorded, a 404 must not cost the connection
+PATHS = ['/player_statistics/ranked/nickname/erpe', '/match_history/ranked/nickname/erpe',
+         '/match/all/matchid/112026229', '/match/summ/matchid/1']
+
+
+def pooled(port, requests, threads, size):
+    pool = ConnectionPool('127.0.0.1:{port}'.format(port=port), size=size)
+    statuses = []
+    count = requests // threads
+    total = count * threads
+    missing = threads * len([i for i in range(count) if PATHS[i % len(PATHS)] == PATHS[-1]])
+
+    def client():
+        for i in range(count):
+            statuses.append(pool.get(PATHS[i % len(PATHS)]).status)
+
+    workers = [threading.Thread(target=client) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    pool.close()
+
+    assert len(statuses) == pool.requests == total, "{n} of {total} requests done".format(n=len(statuses),
+                                                                                          total=total)
+    assert statuses.count(404) == missing and statuses.count(200) == total - missing, "unexpected statuses"
+    assert pool.created <= size, "{created} connections created for a pool of {size}".format(
+        created=pool.created, size=size)
+    assert pool.reused == total - pool.created, "{reused} of {total} requests reused a connection".format(
+        reused=pool.reused, total=total)
+    return elapsed, pool
+
+
+def unpooled(port, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', PATHS[i % len(PATHS)])
+        conn.getresponse().read()
+        conn.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check and time the connection reuse of ConnectionPool')
+    parser.add_argument('-n', '--requests', type=int, default=400, help='number of requests')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='concurrent threads')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every response is delayed')
+    args = parser.parse_args()
+
+    server = ReplayServer(('127.0.0.1', 0), SAMPLEDIR, latency=args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    print("{name:20s} {seconds:>9s} {created:>8s} {reused:>8s}".format(
+        name='', seconds='time', created='created', reused='reused'))
+    for name, threads in (('pool, 1 thread', 1), ('pool, {n} threads'.format(n=args.threads), args.threads)):
+        elapsed, pool = pooled(port, args.requests, threads, size=threads)
+        print("{name:20s} {seconds:8.3f}s {created:8d} {reused:8d}".format(
+            name=name, seconds=elapsed, created=pool.created, reused=pool.reused))
+    elapsed = unpooled(port, args.requests)
+    print("{name:20s} {seconds:8.3f}s {created:8d} {reused:8d}".format(
+        name='no pool', seconds=elapsed, created=args.requests, reused=0))
+    server.shutdown()
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Requests per second of honstats serve against the sample data
+
+Starts the server on a free port with a provider that reads a copy of
+the sampledata directory instead of the API, with the summary of the
+sample match added like match_bench.py builds it, then requests the html pages
+from several client threads, run with: python3 benchmarks/server_bench.py
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import http.client
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+import html
+from provider import FileDataProvider
+from server import HonstatsServer
+from match_bench import SAMPLEMATCHID, writesample
+
+URLS = ['/player/erpe', '/matches/erpe?limit=20', '/match/' + SAMPLEMATCHID]
+
+
+def client(port, urls, requests, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for i in range(requests):
+        conn.request('GET', urls[i % len(urls)])
+        resp = conn.getresponse()
+        resp.read()
+        results.append(resp.status)
+    conn.close()
+
+
+def checkmethods(port):
+    """Requests with other methods than GET must get an error response, not a dropped connection"""
+    for method in ('HEAD', 'POST'):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request(method, URLS[0])
+        resp = conn.getresponse()
+        resp.read()
+        conn.close()
+        assert resp.status == 501, "{method} answered with {status}".format(method=method, status=resp.status)
+
+
+def bench(dp, cachetime, clients, requests):
+    server = HonstatsServer(('127.0.0.1', 0), html.Html(dp), cachetime=cachetime, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_port
+
+    checkmethods(port)
+    # warm up the provider caches
+    client(port, URLS, len(URLS), [])
+
+    results = []
+    threads = [threading.Thread(target=client, args=(port, URLS, requests, results)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    errors = len([status for status in results if status != 200])
+    return len(results) / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark honstats serve on the sample data')
+    parser.add_argument('-c', '--clients', type=int, default=4, help='concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='requests per client')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        datadir = os.path.join(tmpdir, 'data')
+        writesample(datadir)
+        dp = FileDataProvider(datadir, cachedir=os.path.join(tmpdir, 'cache'))
+        # the sample has none of the other match players, give them nicks
+        nicks = {}
+        for stats in dp.fetch('/match/all/matchid/' + SAMPLEMATCHID)[2]:
+            nicks[int(stats['account_id'])] = 'player' + stats['account_id']
+        del nicks[dp.nick2id('erpe')]
+        with dp.db:
+            dp.db.executemany('INSERT OR IGNORE INTO player VALUES( ?, ? );', nicks.items())
+
+        for cachetime in (0, 60):
+            rps, errors = bench(dp, cachetime, args.clients, args.requests)
+            print("response cache {cache:3s}: {rps:8.1f} requests/s, {errors} errors".format(
+                cache='on' if cachetime else 'off', rps=rps, errors=errors))
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,9 @@ You should have received a copy of the GNU General Public License
 along with honstats.  If not, see <http://www.gnu.org/licenses/>.
 """
 import json
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-from datetimeutil import Local, parsedate
+from datetimeutil import Local, epoch, localdatestr
 
 
 class Stats(object):
@@ -87,48 +87,7 @@ class Player(object):
 
     def playerheroes(self, dp, type_=Stats.DefaultStatsType, sortby='use', order='asc'):
         matches = dp.matches(self.id(), type_)
-        playerhero = {}
-        matchdata = dp.fetchmatchdata(matches)
-        for matchid in matchdata:
-            match = Match.creatematch(matchid, matchdata[matchid])
-            if isinstance(match, Match):
-                heroid = int(match.playerstat(self.id(), 'hero_id'))
-                if not heroid in playerhero:
-                    playerhero[heroid] = {'heroid': heroid,
-                                          'use': 0,
-                                          'k': 0,
-                                          'd': 0,
-                                          'a': 0,
-                                          'wins': 0,
-                                          'losses': 0,
-                                          'gpm': 0,
-                                          'wards': 0,
-                                          'gold': 0,
-                                          'playedtime': 0}
-                playerhero[heroid]['use'] += 1
-                playerhero[heroid]['k'] += int(match.playerstat(self.id(), 'herokills'))
-                playerhero[heroid]['d'] += int(match.playerstat(self.id(), 'deaths'))
-                playerhero[heroid]['a'] += int(match.playerstat(self.id(), 'heroassists'))
-                playerhero[heroid]['wins'] += int(match.playerstat(self.id(), 'wins'))
-                playerhero[heroid]['losses'] += int(match.playerstat(self.id(), 'losses'))
-                playerhero[heroid]['gold'] += int(match.playerstat(self.id(), 'gold'))
-                playerhero[heroid]['wards'] += int(match.playerstat(self.id(), 'wards'))
-                playerhero[heroid]['playedtime'] += match.gameduration().total_seconds()
-
-        # finalize stats so we can sort all values easily after
-        for heroid in playerhero:
-            stats = playerhero[heroid]
-            playedtime = stats['playedtime'] if stats['playedtime'] != 0 else 1
-            stats['perc'] = int(stats['use'] / len(matchdata) * 100)
-            stats['kdr'] = stats['k'] / stats['d'] if stats['d'] > 0 else stats['k']
-            stats['kpg'] = stats['k'] / stats['use']
-            stats['dpg'] = stats['d'] / stats['use']
-            stats['apg'] = stats['a'] / stats['use']
-            stats['wpg'] = stats['wards'] / stats['use']
-            stats['gpm'] = int(stats['gold'] / (playedtime / 60))
-            stats['wlr'] = stats['wins'] / stats['losses'] if stats['losses'] > 0 else stats['wins']
-        sortedstats = sorted(playerhero.values(), key=lambda x: x[sortby], reverse=order == 'desc')
-        return sortedstats
+        return dp.playerherostats(self.id(), matches, sortby, order)
 
     @staticmethod
     def header():
@@ -163,6 +122,8 @@ class Player(object):
 
 
 class EmptyMatch():
+    __slots__ = ('data',)
+
     def __init__(self, mid=0):
         self.data = [{'match_id':mid}]
 
@@ -204,8 +165,26 @@ class Match(EmptyMatch):
     MatchesFormat = "{mid:<10d} {gt:2s} {gd:4s} {date:16s} {k:2d} " \
         "{d:2d} {a:2d} {kdr:5.2f} {hero:5s}  {wl:1s}  {wa:2d} {ck:3d} {cd:2d} {gpm:3d}"
 
+    # player stats that are converted to int when the match is created
+    StatFields = ('hero_id', 'team', 'level', 'herokills', 'deaths', 'heroassists', 'wins', 'losses',
+                  'teamcreepkills', 'neutralcreepkills', 'denies', 'wards', 'gold', 'goldlost2death')
+
+    __slots__ = ('playerdata', 'stats', 'teams', 'duration')
+
     def __init__(self, data):
         self.data = data
+        # raw and converted player stats indexed by account id
+        self.playerdata = {}
+        self.stats = {}
+        self.teams = {1: {}, 2: {}}
+        for stats in data[3]:
+            aid = int(stats['account_id'])
+            converted = {field: int(stats[field]) for field in Match.StatFields if stats.get(field) is not None}
+            self.playerdata[aid] = stats
+            self.stats[aid] = converted
+            if converted.get('team') in self.teams:
+                self.teams[converted['team']][aid] = stats
+        self.duration = timedelta(seconds=int(data[0]['time_played']))
 
     @staticmethod
     def creatematch(mid, data):
@@ -243,27 +222,30 @@ class Match(EmptyMatch):
 
     def players(self, team=None):
         if team:
-            iteam = 1 if team == "legion" else 2
-            return {int(data['account_id']): data for data in self.data[3] if int(data['team']) == iteam}
-        return {int(data['account_id']): data for data in self.data[3]}
+            return self.teams[1 if team == "legion" else 2]
+        return self.playerdata
 
     def playermatchstats(self, id_):
-        playerstats = self.data[3]
-        for stats in playerstats:
-            if int(id_) == int(stats['account_id']):
-                return stats
-        return None
+        return self.playerdata.get(int(id_))
 
     def playerstat(self, id_, stat):
-        stats = self.playermatchstats(id_)
-        return int(stats[stat])
+        try:
+            return self.stats[id_][stat]
+        except KeyError:
+            stats = self.playermatchstats(id_)
+            return int(stats[stat])
 
     def gameduration(self):
-        return timedelta(seconds=int(self.data[0]['time_played']))
+        return self.duration
+
+    def gamedate(self):
+        """Seconds since the epoch the match was played, stored as mdt_epoch when the match was downloaded"""
+        summ = self.data[0]
+        timestamp = summ.get('mdt_epoch')
+        return timestamp if timestamp is not None else epoch(summ['mdt'])
 
     def gamedatestr(self):
-        date = parsedate(self.data[0]['mdt'])
-        return date.astimezone(Local).isoformat(' ')[:16]
+        return localdatestr(self.gamedate())
 
     def winner(self):
         legionplayers = self.players(team="legion")
@@ -320,10 +302,11 @@ class Match(EmptyMatch):
                                 assists="A", hell=hellbourne, ck="CK", cd="CD", wards="W", gpm="GPM", gl2d="GL2D")
 
         playerformat = "{nick:14s} {hero:5s} {lvl:2d} {k:2d} {d:2d} {a:2d} {ck:3d} {cd:2d} {wa:2d} {gpm:3d} {gl2d:4d}"
+        nicks = dp.id2nicks(self.playerdata.keys())
         legionstr = []
         for id_ in legionplayers.keys():
             legionstr.append(playerformat.format(
-                nick=dp.id2nick(id_),
+                nick=nicks[id_],
                 hero=dp.heroid2name(self.playerstat(id_, 'hero_id'))[:5],
                 lvl=self.playerstat(id_, 'level'),
                 k=self.playerstat(id_, 'herokills'),
@@ -339,7 +322,7 @@ class Match(EmptyMatch):
         hellstr = []
         for id_ in hellbourneplayers.keys():
             hellstr.append(playerformat.format(
-                nick=dp.id2nick(id_),
+                nick=nicks[id_],
                 hero=dp.heroid2name(self.playerstat(id_, 'hero_id'))[:5],
                 lvl=self.playerstat(id_, 'level'),
                 k=self.playerstat(id_, 'herokills'),
@@ -14,7 +14,8 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with honstats.  If not, see <http://www.gnu.org/licenses/>.
 """
-from datetime import datetime, timedelta, tzinfo
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
 
 # A class capturing the platform's idea of local time.
 
@@ -49,15 +50,51 @@ class LocalTimezone(tzinfo):
 
     @classmethod
     def _isdst(cls, dt):
-        tt = (dt.year, dt.month, dt.day,
-              dt.hour, dt.minute, dt.second,
-              dt.weekday(), 0, 0)
-        stamp = _time.mktime(tt)
-        tt = _time.localtime(stamp)
-        return tt.tm_isdst > 0
+        isdst = _isdstbucket(dt.year, dt.month, dt.day, dt.hour, dt.minute // 15 * 15)
+        if isdst is None:
+            isdst = _isdstat(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+        return isdst
+
+
+def _isdstat(year, month, day, hour, minute, second):
+    stamp = _time.mktime((year, month, day, hour, minute, second, 0, 0, 0))
+    return _time.localtime(stamp).tm_isdst > 0
+
+
+@lru_cache(maxsize=1 << 17)
+def _isdstbucket(year, month, day, hour, minute):
+    """DST of the quarter hour starting at minute, None if it switches within.
+       Most zones switch on full or half hours, Pacific/Chatham on 02:45 and
+       until 2011 America/St_Johns on 00:01, those quarters are decided per date."""
+    first = _isdstat(year, month, day, hour, minute, 0)
+    if first != _isdstat(year, month, day, hour, minute + 14, 59):
+        return None
+    return first
 
 Local = LocalTimezone()
 
+# the API returns dates in a fixed format and timezone
+APIFORMAT = "%Y-%m-%d %H:%M:%S"
+APITZ = timezone(timedelta(hours=-4))
+
 
 def parsedate(datestr):
-    return datetime.strptime(datestr + " -0400",  "%Y-%m-%d %H:%M:%S %z")
+    """Parses an API date like 2013-03-01 21:12:37, the fixed format is sliced instead of using strptime"""
+    if len(datestr) == 19 and datestr[4] == '-' and datestr[7] == '-' and datestr[10] == ' ' \
+            and datestr[13] == ':' and datestr[16] == ':':
+        try:
+            return datetime(int(datestr[0:4]), int(datestr[5:7]), int(datestr[8:10]),
+                            int(datestr[11:13]), int(datestr[14:16]), int(datestr[17:19]), tzinfo=APITZ)
+        except ValueError:
+            pass
+    return datetime.strptime(datestr, APIFORMAT).replace(tzinfo=APITZ)
+
+
+def epoch(datestr):
+    """Seconds since the epoch of an API date"""
+    return int(parsedate(datestr).timestamp())
+
+
+def localdatestr(timestamp):
+    """Formats seconds since the epoch as local 'YYYY-MM-DD HH:MM'"""
+    return datetime.fromtimestamp(timestamp, Local).isoformat(' ')[:16]
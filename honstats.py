@@ -25,11 +25,17 @@ import configparser
 
 import text
 import html
-from provider import HttpDataProvider
+import server
+import instrument
+import sync
+from provider import HttpDataProvider, FileDataProvider
 
 
 def printoutput(output):
-    print(output, end='')
+    """Writes the chunks of an output generator as soon as they are produced"""
+    for chunk in output:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
 
 
 def playercommand(args):
@@ -58,16 +64,49 @@ def heroescommand(args):
     printoutput(args.outputobj.heroesinfo(args.limit))
 
 
+def servecommand(args):
+    server.serve(html.Html(args.dataprovider, templatedir=args.templatedir), host=args.bind, port=args.port,
+                 statstype=args.statstype, limit=args.limit, cachetime=args.cache_time, quiet=args.quiet)
+
+
+def synccommand(args):
+    players = args.id if args.id else sync.parselist(args.config_players)
+    if not players:
+        sys.exit('No players given and no players in the [sync] section of the config file.')
+    printoutput(sync.sync(args.dataprovider, players, args.sync_statstypes, interval=args.interval,
+                          depth=args.depth, once=args.once))
+
+
+def importmatchescommand(args):
+    printoutput(["{count} matches imported\n".format(count=args.dataprovider.importmatches())])
+
+
+def compactcommand(args):
+    removed = args.dataprovider.compactplayerdata(interval=args.interval, retention=args.retention)
+    if args.vacuum:
+        args.dataprovider.vacuum()
+    printoutput(["{count} player snapshots removed\n".format(count=removed)])
+
+
 def main():
     parser = argparse.ArgumentParser(description='honstats fetches and displays Heroes of Newerth statistics')
     parser.add_argument('-q', '--quiet', action='store_true', help='Limit exception output to one liners')
-    parser.add_argument('--host', default='api.heroesofnewerth.com', help='statistic host provider')
+    parser.add_argument('--host', help='statistic host provider, default api.heroesofnewerth.com')
     parser.add_argument('-l', '--limit', type=int, help='Limit output to the given number')
     parser.add_argument('-t', '--token', help="hon statistics token")
     parser.add_argument('-s', '--statstype', choices=['ranked', 'public', 'casual'],
                         default='ranked', help='Statstype to show')
     parser.add_argument('--config', default='/etc/honstats', help='path to configuration file')
     parser.add_argument('-o', '--outputmode', choices=['text', 'html'], default='text', help='set output mode')
+    parser.add_argument('-w', '--workers', type=int, help='number of concurrent match downloads')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of players processed concurrently')
+    parser.add_argument('--rate', type=float, help='maximum API requests per second, 0 for no limit')
+    parser.add_argument('--cachedir', help='cache directory, overrides the configuration file')
+    parser.add_argument('--replay', metavar='DIR', help='answer API requests from recorded responses in DIR, '
+                                                        'e.g. sampledata, instead of the API')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every replayed request is delayed')
+    parser.add_argument('--profile', action='store_true', help='print time spent per stage to stderr')
+    parser.add_argument('--profile-json', metavar='FILE', help='write the profile as json to FILE')
 
     subparsers = parser.add_subparsers(help='honstats commands')
     playercmd = subparsers.add_parser('player', help='Show player stats')
@@ -99,35 +138,107 @@ def main():
     heroescmd = subparsers.add_parser('heroes', help='Show hero statistics')
     heroescmd.set_defaults(func=heroescommand)
 
+    importmatchescmd = subparsers.add_parser('import-matches',
+                                             help='Import the gzip match file cache into the match database '
+                                                  'or archive')
+    importmatchescmd.set_defaults(func=importmatchescommand)
+
+    compactcmd = subparsers.add_parser('compact', help='Remove old player stats snapshots from the cache')
+    compactcmd.set_defaults(func=compactcommand)
+    compactcmd.add_argument('--interval', type=float, help='keep one snapshot per this many hours, default 24')
+    compactcmd.add_argument('--retention', type=int, help='remove snapshots older than this many days '
+                                                          'except the newest, default 0 keeps all')
+    compactcmd.add_argument('--vacuum', action='store_true', help='shrink the database file afterwards')
+
+    synccmd = subparsers.add_parser('sync', help='Keep the stats and matches of a watch-list of players cached')
+    synccmd.set_defaults(func=synccommand)
+    synccmd.add_argument('id', nargs='*', help='Player nickname or hon id, default the [sync] players')
+    synccmd.add_argument('--once', action='store_true', help='sync every player once and exit')
+    synccmd.add_argument('--interval', type=int, help='seconds between syncs, default 300')
+    synccmd.add_argument('--depth', type=int, help='only download the newest matches of every player')
+
+    servecmd = subparsers.add_parser('serve', help='Serve the html output over HTTP')
+    servecmd.set_defaults(func=servecommand)
+    servecmd.add_argument('-b', '--bind', default='127.0.0.1', help='address to listen on')
+    servecmd.add_argument('-p', '--port', default=8080, type=int, help='port to listen on')
+    servecmd.add_argument('--cache-time', default=60, type=int, help='seconds a rendered page is cached')
+
     args = parser.parse_args()
 
     try:
         configpath = args.config
         if not os.path.exists(configpath):
             configpath = os.path.expanduser('~/.config/honstats/config')
+        cp = configparser.ConfigParser({'directory': os.path.expanduser('~/.honstats')})
         if os.path.exists(configpath):
-            cp = configparser.ConfigParser({'directory': os.path.expanduser('~/.honstats')})
             cp.read(configpath)
-        else:
-            cp = {}
 
-        if not args.token and not 'auth' in cp:
-            sys.exit('Token not specified and no config file found.')
-        else:
+        if not args.token and not args.replay:
+            if not 'auth' in cp:
+                sys.exit('Token not specified and no config file found.')
             args.token = cp.get('auth', 'token')
 
-        host = "http://{host}".format(host=cp.get('auth', 'host', fallback=args.host))
+        host = "http://{host}".format(host=args.host if args.host else
+                                      cp.get('auth', 'host', fallback='api.heroesofnewerth.com'))
 
         if 'func' in args:
-            args.dataprovider = HttpDataProvider(host, token=args.token, cachedir=cp.get('cache', 'directory'))
+            workers = args.workers if args.workers else cp.getint('fetch', 'workers', fallback=4)
+            rate = args.rate if args.rate is not None else cp.getfloat('fetch', 'rate', fallback=10)
+            if args.replay and args.rate is None:
+                # the api rate limit doesn't apply to recorded responses
+                rate = 0
+            cachedir = args.cachedir if args.cachedir else cp.get('cache', 'directory',
+                                                                  fallback=os.path.expanduser('~/.honstats'))
+            options = {'workers': workers,
+                       'poolsize': cp.getint('fetch', 'poolsize', fallback=workers),
+                       'rate': rate,
+                       'retries': cp.getint('fetch', 'retries', fallback=HttpDataProvider.MaxRetries),
+                       'matchstore': cp.get('cache', 'matchstore', fallback='files'),
+                       'lrusize': cp.getint('cache', 'lrusize', fallback=HttpDataProvider.LRUSize),
+                       'matchformat': cp.get('cache', 'matchformat', fallback='json')}
+            if args.replay:
+                # keep replayed data out of the real cache
+                cachedir = cachedir if args.cachedir else os.path.join(cachedir, 'replay')
+                args.dataprovider = FileDataProvider(args.replay, latency=args.latency, cachedir=cachedir,
+                                                     **options)
+            else:
+                args.dataprovider = HttpDataProvider(host, token=args.token, cachedir=cachedir, **options)
+
+            if args.func == synccommand:
+                args.config_players = cp.get('sync', 'players', fallback='')
+                args.sync_statstypes = sync.parselist(cp.get('sync', 'statstypes', fallback=args.statstype))
+                if args.interval is None:
+                    args.interval = cp.getint('sync', 'interval', fallback=sync.DefaultInterval)
+                if args.depth is None:
+                    args.depth = cp.getint('sync', 'depth', fallback=0)
+
+            if args.func == compactcommand:
+                if args.interval is None:
+                    args.interval = cp.getfloat('cache', 'snapshotinterval', fallback=24)
+                if args.retention is None:
+                    args.retention = cp.getint('cache', 'snapshotretention', fallback=0)
 
             # set output class
+            args.templatedir = cp.get('html', 'templatedir', fallback=None)
             if args.outputmode == 'html':
-                args.outputobj = html.Html(args.dataprovider)
+                args.outputobj = html.Html(args.dataprovider, templatedir=args.templatedir, jobs=args.jobs)
             else:
-                args.outputobj = text.Text(args.dataprovider)
-
-            args.func(args)
+                args.outputobj = text.Text(args.dataprovider, jobs=args.jobs)
+
+            profiler = None
+            if args.profile or args.profile_json:
+                profiler = instrument.Profiler()
+                profiler.instrumentprovider(args.dataprovider)
+                profiler.instrumentoutput(args.outputobj)
+            try:
+                args.func(args)
+            finally:
+                args.dataprovider.close()
+                if profiler:
+                    if args.profile:
+                        sys.stderr.write(profiler.format())
+                    if args.profile_json:
+                        profiler.dump(args.profile_json)
         else:
             parser.print_help()
     except Exception as e:
@@ -18,8 +18,11 @@ along with honstats.  If not, see <http://www.gnu.org/licenses/>.
 """
 __author__ = 'rp'
 
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
 import text
-from string import Template
+from template import templatecache
 
 from data import Player, Match, Hero
 
@@ -31,127 +34,129 @@ class LinkItem():
         self.value = value
 
     def __str__(self):
-        return '<a href="{link}">{value}</a>'.format(link=self.link, value=self.value)
+        return '<a href="{link}">{value}</a>'.format(link=escape(self.link, {'"': '&quot;'}),
+                                                     value=escape(str(self.value)))
 
 
 class Html(text.Text):
+    # row format strings by (cell type, alignments)
+    RowFormats = {}
 
-    def __init__(self, dp):
-        text.Text.__init__(self, dp)
+    def __init__(self, dp, templatedir=None, jobs=1):
+        text.Text.__init__(self, dp, jobs)
+        self.templates = templatecache(templatedir)
 
+    def loadtemplates(self):
+        return self.templates.get('html_header'), self.templates.get('html_footer')
 
     @classmethod
-    def loadtemplates(cls):
-        with open('/opt/honstats/templates/html_header.tmpl', 'r') as header:
-            tmpl_header = Template(header.read())
-
-        with open('/opt/honstats/templates/html_footer.tmpl', 'r') as footer:
-            tmpl_footer = Template(footer.read())
-        return tmpl_header, tmpl_footer
+    def rowformat(cls, _type, aligns):
+        key = (_type, aligns)
+        if key not in cls.RowFormats:
+            cls.RowFormats[key] = ''.join('<{type_} align="{align}">{{}}</{type_}>'.format(type_=_type, align=align)
+                                          for align in aligns)
+        return cls.RowFormats[key]
 
     @classmethod
     def list2cols(cls, l, _type='td'):
-        ret = ''
-        for i in l:
-            align = "left" if isinstance(i, str) or isinstance(i, LinkItem) else "right"
-            ret += '<{type_} align="{align}">{item}</{type_}>'.format(item=i, type_=_type, align=align)
-        return ret
+        aligns = tuple("left" if isinstance(i, str) or isinstance(i, LinkItem) else "right" for i in l)
+        return cls.rowformat(_type, aligns).format(*l)
 
     def playerinfo(self, ids, statstype):
-        tmpl_header, tmpl_footer = Html.loadtemplates()
-
-        output = tmpl_header.substitute()
-
-        output += '<h1>Player stats</h1>'
-        output += '<table cellspacing="0" cellpadding="2">'
-        output += '<tr>' + Html.list2cols(['Nick', 'MMR', 'K', 'D', 'A', 'W/G', 'CD',
-                                           'KDR', 'GP', 'Wins', 'Losses', 'W%'], 'th') + '</tr>'
-
-        for id_ in ids:
-            data = self.dp.fetchplayer(id_, statstype)
-            nickname = self.dp.id2nick(int(data['account_id']))
-            player = Player(nickname, data)
-            pdata = [player.rating(statstype),
-                     player.kills(statstype),
-                     player.deaths(statstype),
-                     player.assists(statstype),
-                     round(player.wards(statstype)/player.gamesplayed(statstype), 2),
-                     round(player.denies(statstype)/player.gamesplayed(statstype), 2),
-                     round(player.kills(statstype)/player.deaths(statstype), 2),
-                     player.gamesplayed(statstype),
-                     player.wins(statstype),
-                     player.losses(statstype),
-                     round(player.wins(statstype)/player.gamesplayed(statstype) * 100, 2)]
-            output += '<tr><td><a href="/matches/{nick}">{nick}</a></td>'.format(nick=nickname)
-            output += Html.list2cols(pdata)
-            output += '</tr>'
-        output += '</table>'
-        output += tmpl_footer.substitute()
-        return output
+        tmpl_header, tmpl_footer = self.loadtemplates()
+
+        yield tmpl_header.substitute()
+
+        yield '<h1>Player stats</h1>'
+        yield '<table cellspacing="0" cellpadding="2">'
+        yield '<tr>' + Html.list2cols(['Nick', 'MMR', 'K', 'D', 'A', 'W/G', 'CD',
+                                          'KDR', 'GP', 'Wins', 'Losses', 'W%'], 'th') + '</tr>'
+        yield from self.forplayers(ids, self.playerinfoplayer, statstype)
+        yield '</table>'
+        yield tmpl_footer.substitute()
+
+    def playerinfoplayer(self, id_, statstype):
+        data = self.dp.fetchplayer(id_, statstype)
+        nickname = self.dp.id2nick(int(data['account_id']))
+        player = Player(nickname, data)
+        pdata = [player.rating(statstype),
+                 player.kills(statstype),
+                 player.deaths(statstype),
+                 player.assists(statstype),
+                 round(player.wards(statstype)/player.gamesplayed(statstype), 2),
+                 round(player.denies(statstype)/player.gamesplayed(statstype), 2),
+                 round(player.kills(statstype)/player.deaths(statstype), 2),
+                 player.gamesplayed(statstype),
+                 player.wins(statstype),
+                 player.losses(statstype),
+                 round(player.wins(statstype)/player.gamesplayed(statstype) * 100, 2)]
+        yield '<tr><td>{link}</td>'.format(link=LinkItem('/matches/' + quote(nickname, safe=''), nickname)) + \
+            Html.list2cols(pdata) + '</tr>'
 
     def matchesinfo(self, ids, statstype, limit):
-        tmpl_h, tmpl_f = Html.loadtemplates()
-
-        output = tmpl_h.substitute()
-
-        for id_ in ids:
-            output += '<h2>{nick}</h2>'.format(nick=id_)
-            output += '<table cellspacing="0" cellpadding="2">'
-            output += '<tr>' + Html.list2cols(['MID', 'GT', 'GD', 'Date', 'K', 'D', 'A', 'KDR',
-                                               'Hero', 'WL', 'Wards', 'CK', 'CD', 'GPM'], 'th') + '</tr>'
-
-            matchids = self.dp.matches(id_, statstype)
-            avgdata = text.Text.initavgdata()
-            limit = limit if limit else len(matchids)
-
-            for i in range(limit):
-                matches = self.dp.fetchmatchdata([matchids[i]])
-                match = Match.creatematch(matchids[i], matches[matchids[i]])
-
-                if isinstance(match, Match):
-                    matchdata = match.matchesdata(self.dp.nick2id(id_), self.dp)
-                    avgdata = text.Text.fillavgdata(avgdata, matchdata)
-
-                rowdata = [LinkItem("/match/" + str(matchdata['mid']), matchdata['mid']),
-                           matchdata['gt'],
-                           matchdata['gd'],
-                           matchdata['date'],
-                           matchdata['k'],
-                           matchdata['d'],
-                           matchdata['a'],
-                           round(matchdata['kdr'], 2),
-                           matchdata['hero'],
-                           matchdata['wl'],
-                           matchdata['wa'],
-                           matchdata['ck'],
-                           matchdata['cd'],
-                           matchdata['gpm']]
-                output += '<tr>' + Html.list2cols(rowdata) + '</tr>'
-
-            output += '</table>'
-        return output + tmpl_f.substitute()
+        tmpl_h, tmpl_f = self.loadtemplates()
+
+        yield tmpl_h.substitute()
+        yield from self.forplayers(ids, self.matchesinfoplayer, statstype, limit)
+        yield tmpl_f.substitute()
+
+    def matchesinfoplayer(self, id_, statstype, limit):
+        yield '<h2>{nick}</h2>'.format(nick=escape(str(id_)))
+        yield '<table cellspacing="0" cellpadding="2">'
+        yield '<tr>' + Html.list2cols(['MID', 'GT', 'GD', 'Date', 'K', 'D', 'A', 'KDR',
+                                      'Hero', 'WL', 'Wards', 'CK', 'CD', 'GPM'], 'th') + '</tr>'
+
+        matchids = self.dp.matches(id_, statstype)
+        limit = limit if limit else len(matchids)
+        aid = self.dp.nick2id(id_)
+
+        for mid, data in self.dp.itermatchdata(matchids[:limit], player=aid):
+            match = Match.creatematch(mid, data)
+
+            if not isinstance(match, Match):
+                yield '<tr><td align="right">{mid}</td><td colspan="13">Unable to fetch</td></tr>'.format(mid=mid)
+                continue
+            matchdata = match.matchesdata(aid, self.dp)
+
+            rowdata = [LinkItem("/match/" + str(matchdata['mid']), matchdata['mid']),
+                       matchdata['gt'],
+                       matchdata['gd'],
+                       matchdata['date'],
+                       matchdata['k'],
+                       matchdata['d'],
+                       matchdata['a'],
+                       round(matchdata['kdr'], 2),
+                       matchdata['hero'],
+                       matchdata['wl'],
+                       matchdata['wa'],
+                       matchdata['ck'],
+                       matchdata['cd'],
+                       matchdata['gpm']]
+            yield '<tr>' + Html.list2cols(rowdata) + '</tr>'
+
+        yield '</table>'
 
     def matchinfo(self, ids):
-        matches = self.dp.fetchmatchdata(ids)
-        tmpl_h, tmpl_f = Html.loadtemplates()
+        tmpl_h, tmpl_f = self.loadtemplates()
 
-        output = tmpl_h.substitute()
+        yield tmpl_h.substitute()
 
-        for mid in ids:
-            match = Match.creatematch(mid, matches[mid])
+        for mid, data in self.dp.itermatchdata(ids):
+            match = Match.creatematch(mid, data)
             legionplayers = match.players(team="legion")
             hellbourneplayers = match.players(team='hellbourne')
 
-            output += '<h2>{mid}</h2>'.format(mid=mid)
+            output = '<h2>{mid}</h2>'.format(mid=mid)
             output += match.gamedatestr() + ' GD: ' + str(match.gameduration()) + '<br />\n'
             output += '<table cellspacing="0" cellpadding="2">'
             output += '<tr>'
             output += Html.list2cols(['Legion', 'Hero', 'LVL', 'K', 'D', 'A', 'CK', 'CD', 'W', 'GPM', 'GL2D',
                                       'Hellbourne', 'Hero', 'LVL', 'K', 'D', 'A', 'CK', 'CD', 'W', 'GPM', 'GL2D'], 'th')
 
+            nicks = self.dp.id2nicks(match.players().keys())
             legioncols = []
             for id_ in legionplayers.keys():
-                legioncols.append([LinkItem('/player/{nick}'.format(nick=self.dp.id2nick(id_)), self.dp.id2nick(id_)),
+                legioncols.append([LinkItem('/player/' + quote(nicks[id_], safe=''), nicks[id_]),
                                   self.dp.heroid2name(match.playerstat(id_, 'hero_id')),
                                   match.playerstat(id_, 'level'),
                                   match.playerstat(id_, 'herokills'),
@@ -165,7 +170,7 @@ class Html(text.Text):
 
             hellcols = []
             for id_ in hellbourneplayers.keys():
-                hellcols.append([LinkItem('/player/{nick}'.format(nick=self.dp.id2nick(id_)), self.dp.id2nick(id_)),
+                hellcols.append([LinkItem('/player/' + quote(nicks[id_], safe=''), nicks[id_]),
                                 self.dp.heroid2name(match.playerstat(id_, 'hero_id')),
                                 match.playerstat(id_, 'level'),
                                 match.playerstat(id_, 'herokills'),
@@ -186,4 +191,5 @@ class Html(text.Text):
 
             output += '</tr>'
             output += '</table>'
-        return output + tmpl_f.substitute()
+            yield output
+        yield tmpl_f.substitute()
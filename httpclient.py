@@ -0,0 +1,183 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import gzip
+import http.client
+import random
+import threading
+import time
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+
+class Response(object):
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class ConnectionPool(object):
+    """Keeps persistent keep-alive connections to a single host.
+
+       At most `size` connections are open at the same time, callers
+       beyond that wait until a connection is released.
+    """
+
+    def __init__(self, url, size=4, timeout=30):
+        if '://' not in url:
+            url = 'http://' + url
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.basepath = parts.path.rstrip('/')
+        self.size = max(1, size)
+        self.timeout = timeout
+
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.size)
+
+        # statistics
+        self.created = 0
+        self.reused = 0
+        self.requests = 0
+
+    def newconnection(self):
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        with self.lock:
+            self.created += 1
+        return conn
+
+    def acquire(self):
+        """Returns a tuple of (connection, reused)"""
+        self.slots.acquire()
+        with self.lock:
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop(), True
+        return self.newconnection(), False
+
+    def release(self, conn, close=False):
+        if close:
+            conn.close()
+        else:
+            with self.lock:
+                self.idle.append(conn)
+        self.slots.release()
+
+    def get(self, path):
+        """Sends a GET request for path and returns the Response, the body is already gzip decoded."""
+        conn, reused = self.acquire()
+        try:
+            try:
+                resp = self.request(conn, path)
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if not reused:
+                    raise
+                # the server closed the idle keep-alive connection, retry once with a fresh one
+                conn = self.newconnection()
+                resp = self.request(conn, path)
+            body = resp.read()
+        except Exception:
+            self.release(conn, close=True)
+            raise
+        self.release(conn, close=resp.will_close)
+
+        with self.lock:
+            self.requests += 1
+
+        if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        return Response(resp.status, resp.reason, resp.msg, body)
+
+    def request(self, conn, path):
+        conn.request('GET', self.basepath + path, headers={'Accept-Encoding': 'gzip',
+                                                           'Connection': 'keep-alive'})
+        return conn.getresponse()
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+
+class RateLimiter(object):
+    """Token bucket allowing `rate` requests per second with bursts of up to `burst` requests.
+
+       One limiter is shared by all threads of a provider, a rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Takes a token, sleeping until it is available"""
+        if not self.rate:
+            return
+        with self.lock:
+            self.refill()
+            # reserve the token now and wait outside of the lock for our turn
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Makes all following requests wait at least seconds, used if the server throttles us"""
+        if not self.rate:
+            time.sleep(seconds)
+            return
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def retryafter(headers):
+    """Returns the seconds to wait from a Retry-After header or None"""
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoffdelay(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with jitter for the given retry attempt (starting at 0)"""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
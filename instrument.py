@@ -0,0 +1,151 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import functools
+import inspect
+import json
+import math
+import threading
+import time
+
+from data import Match
+
+# methods timed by instrumentprovider, by stage prefix
+ProviderMethods = ('fetch', 'fetchplayer', 'fetchmatches', 'fetchmatch', 'itermatchdata', 'storematches',
+                   'indexmatches', 'playerherostats', 'heroes', 'nick2id', 'id2nick', 'id2nicks', 'heroid2name')
+MatchStoreMethods = ('cachedids', 'load', 'storemany')
+RenderMethods = ('matchesdata', 'matchesstr', 'matchstr')
+OutputMethods = ('playerinfo', 'matchesinfo', 'matchinfo', 'playerheroesinfo', 'lastmatchesinfo', 'heroesinfo')
+
+
+def percentile(values, perc):
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(perc / 100 * len(values)) - 1)]
+
+
+class Profiler(object):
+    """Collects call counts and durations per stage.
+
+       Stages are timed inclusively, the time of fetch is also part of
+       fetchmatch and itermatchdata. Generators are timed while they run,
+       not while the consumer works on what they yielded.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.dp = None
+        self.patched = []
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.timings.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, func):
+        """Returns func timed as stage"""
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def timedgenerator(*args, **kwargs):
+                gen = func(*args, **kwargs)
+                elapsed = 0.0
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(gen)
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                except StopIteration:
+                    pass
+                finally:
+                    gen.close()
+                    self.record(stage, elapsed)
+            return timedgenerator
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def instrument(self, obj, prefix, methods):
+        """Times methods of obj, for an instance only this instance is affected, for a class all instances"""
+        for name in methods:
+            if isinstance(obj, type):
+                self.patched.append((obj, name, obj.__dict__[name]))
+            setattr(obj, name, self.wrap(prefix + '.' + name, getattr(obj, name)))
+
+    def instrumentprovider(self, dp):
+        self.dp = dp
+        self.instrument(dp, 'provider', ProviderMethods)
+        self.instrument(dp.http, 'http', ('get',))
+        self.instrument(dp.matchstore, 'matchstore', MatchStoreMethods)
+
+    def instrumentoutput(self, outputobj):
+        self.instrument(outputobj, 'output', OutputMethods)
+        self.instrument(Match, 'render', RenderMethods)
+
+    def restore(self):
+        """Removes the timing wrappers from classes"""
+        for cls, name, func in reversed(self.patched):
+            setattr(cls, name, func)
+        self.patched = []
+
+    def report(self):
+        """Returns a dict with the wall time, the stats per stage and the provider counters"""
+        stages = {}
+        with self.lock:
+            for stage, timings in self.timings.items():
+                timings = sorted(timings)
+                total = sum(timings)
+                stages[stage] = {'calls': len(timings),
+                                 'total': total,
+                                 'avg': total / len(timings),
+                                 'p95': percentile(timings, 95),
+                                 'max': timings[-1]}
+        report = {'wall': time.perf_counter() - self.started, 'stages': stages}
+        if self.dp is not None:
+            counters = dict(self.dp.counters)
+            for name in ('nicks', 'ids', 'heronames'):
+                cache = getattr(self.dp, name)
+                counters[name + '_hits'] = cache.hits
+                counters[name + '_misses'] = cache.misses
+            report['counters'] = counters
+        return report
+
+    def format(self):
+        report = self.report()
+        lines = ["{stage:28s} {calls:>7s} {total:>9s} {avg:>9s} {p95:>9s}".format(
+            stage='stage', calls='calls', total='total ms', avg='avg ms', p95='p95 ms')]
+        for stage, stats in sorted(report['stages'].items(), key=lambda item: item[1]['total'], reverse=True):
+            lines.append("{stage:28s} {calls:7d} {total:9.1f} {avg:9.3f} {p95:9.3f}".format(
+                stage=stage, calls=stats['calls'], total=stats['total'] * 1000, avg=stats['avg'] * 1000,
+                p95=stats['p95'] * 1000))
+        for name, value in sorted(report.get('counters', {}).items()):
+            lines.append("{name:28s} {value:7d}".format(name=name, value=value))
+        lines.append("{name:28s} {wall:9.1f} ms".format(name='wall time', wall=report['wall'] * 1000))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,157 @@
+"""
+Compact binary format of a cached match.
+
+A match is a fixed size header with the summary and the game options the
+output needs, one fixed size record of integers per player and a zlib
+compressed json document with all remaining fields:
+
+  header   magic, match_id, mdt_epoch, time_played, ap, ar, number of players
+  records  PlayerFields of every player as little endian integers
+  extras   zlib(json) of the remaining summary, settings, items and stats fields,
+           the stats field names once and the values as list per player
+
+The stats of a single player are decoded from its record alone, without
+touching the compressed part.
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import struct
+import zlib
+
+from datetimeutil import epoch
+
+Magic = b'HSM1'
+Extension = '.hsm'
+
+# fixed player fields and their struct format, a value out of range keeps the match in the json format
+PlayerFields = ('account_id', 'hero_id', 'team', 'level', 'herokills', 'deaths', 'heroassists', 'wins', 'losses',
+                'teamcreepkills', 'neutralcreepkills', 'denies', 'wards', 'gold', 'goldlost2death', 'secs')
+PlayerFormats = ('i', 'H', 'B', 'B', 'H', 'H', 'H', 'B', 'B',
+                 'H', 'H', 'H', 'H', 'i', 'i', 'I')
+
+Header = struct.Struct('<4sqqiBBB')
+Record = struct.Struct('<' + ''.join(PlayerFormats))
+AccountId = struct.Struct('<i')
+
+
+def isencoded(blob):
+    return blob[:len(Magic)] == Magic
+
+
+def _int(value):
+    """value as int if it is an integer that converts back to the same string, else raises ValueError"""
+    try:
+        converted = int(value)
+    except TypeError:
+        converted = None
+    if converted is None or str(converted) != str(value):
+        raise ValueError("Not an integer: {value!r}".format(value=value))
+    return converted
+
+
+def _pop(fields, name):
+    """Removes and returns a field that must be there, a missing one raises ValueError"""
+    try:
+        return fields.pop(name)
+    except KeyError:
+        raise ValueError("Missing field: " + name)
+
+
+def encode(matchdata):
+    """Encodes the matchdata of a downloaded match.
+
+       Raises:
+         ValueError if the match doesn't fit the fixed fields, those are stored in the legacy format
+    """
+    summ, settings, items, playerstats = matchdata
+    if not isinstance(summ, dict) or not isinstance(settings, dict):
+        raise ValueError("Not a downloaded match")
+    summ = dict(summ)
+    settings = dict(settings)
+    matchid = _int(_pop(summ, 'match_id'))
+    timestamp = summ.pop('mdt_epoch', None)
+    if timestamp is None:
+        if summ.get('mdt') is None:
+            raise ValueError("Missing field: mdt")
+        timestamp = epoch(summ['mdt'])
+    timeplayed = _int(_pop(summ, 'time_played'))
+    if _int(settings.pop('match_id', matchid)) != matchid:
+        raise ValueError("Settings of another match")
+    ap = _int(settings.pop('ap', 0))
+    ar = _int(settings.pop('ar', 0))
+
+    records = []
+    extrastats = []
+    for stats in playerstats:
+        stats = dict(stats)
+        if _int(stats.pop('match_id', matchid)) != matchid:
+            raise ValueError("Player stats of another match")
+        records.append(tuple(_int(_pop(stats, field)) for field in PlayerFields))
+        extrastats.append(stats)
+    # the remaining fields are stored once, and every player as list of values
+    fields = list(extrastats[0]) if extrastats else []
+    if any(list(stats) != fields for stats in extrastats):
+        raise ValueError("Players with different fields")
+
+    try:
+        header = Header.pack(Magic, matchid, timestamp, timeplayed, ap, ar, len(records))
+        body = b''.join(Record.pack(*record) for record in records)
+    except struct.error as e:
+        raise ValueError(str(e))
+    extras = {'summ': summ, 'settings': settings, 'items': items, 'fields': fields,
+              'stats': [list(stats.values()) for stats in extrastats]}
+    return header + body + zlib.compress(json.dumps(extras, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _summary(blob):
+    magic, matchid, timestamp, timeplayed, ap, ar, players = Header.unpack_from(blob)
+    if magic != Magic:
+        raise ValueError("Not an encoded match")
+    summ = {'match_id': matchid, 'mdt_epoch': timestamp, 'time_played': timeplayed}
+    settings = {'match_id': matchid, 'ap': ap, 'ar': ar}
+    return summ, settings, players
+
+
+def decode(blob):
+    """Returns the matchdata of an encoded match, PlayerFields and the ids are ints instead of strings"""
+    summ, settings, players = _summary(blob)
+    end = Header.size + Record.size * players
+    extras = json.loads(zlib.decompress(blob[end:]).decode('utf-8'))
+    summ.update(extras['summ'])
+    settings.update(extras['settings'])
+    playerstats = []
+    for record, values in zip(Record.iter_unpack(blob[Header.size:end]), extras['stats']):
+        stats = dict(zip(extras['fields'], values))
+        stats.update(zip(PlayerFields, record))
+        stats['match_id'] = summ['match_id']
+        playerstats.append(stats)
+    return [summ, settings, extras['items'], playerstats]
+
+
+def decodeplayer(blob, aid):
+    """Returns matchdata with only the summary, the game options and the PlayerFields of player aid.
+       That is enough for the match list of a player, but not for the whole match."""
+    summ, settings, players = _summary(blob)
+    playerstats = []
+    for i in range(players):
+        offset = Header.size + Record.size * i
+        if AccountId.unpack_from(blob, offset)[0] == aid:
+            stats = dict(zip(PlayerFields, Record.unpack_from(blob, offset)))
+            stats['match_id'] = summ['match_id']
+            playerstats.append(stats)
+            break
+    return [summ, settings, [], playerstats]
@@ -0,0 +1,169 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import json
+import gzip
+import threading
+import zlib
+
+import matchcodec
+from data import Match
+
+MATCHDBCREATE = """
+CREATE TABLE IF NOT EXISTS match (
+id INTEGER PRIMARY KEY,
+date INTEGER,
+gametype TEXT,
+duration INTEGER,
+data BLOB
+);
+
+CREATE INDEX IF NOT EXISTS match_date ON match(date);
+CREATE INDEX IF NOT EXISTS match_gametype ON match(gametype, duration);
+"""
+
+
+class FileMatchStore(object):
+    """Stores every match as gzip'd json file in match/<first 4 digits>/<matchid>.gz, or in the compact
+       matchcodec format as <matchid>.hsm. Both formats are read, so a cache can hold a mix of them."""
+
+    def __init__(self, matchdir, compact=False):
+        self.matchdir = matchdir
+        self.compact = compact
+        # the format written is looked for first
+        self.extensions = (matchcodec.Extension, '.gz') if compact else ('.gz', matchcodec.Extension)
+
+    def path(self, matchid, extension='.gz'):
+        return os.path.join(self.matchdir, str(matchid)[0:4], str(matchid) + extension)
+
+    def cachedids(self, matchids):
+        return set(matchid for matchid in matchids
+                   if any(os.path.exists(self.path(matchid, extension)) for extension in self.extensions))
+
+    def load(self, matchid, aid=None):
+        """Returns the match data or None if the match isn't cached.
+           With aid compact matches only decode the stats of that player, see matchcodec.decodeplayer."""
+        for extension in self.extensions:
+            try:
+                if extension == '.gz':
+                    with gzip.open(self.path(matchid), 'rt') as f:
+                        return json.load(f)
+                with open(self.path(matchid, extension), 'rb') as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                continue
+            return matchcodec.decodeplayer(blob, aid) if aid is not None else matchcodec.decode(blob)
+        return None
+
+    def storemany(self, matches):
+        for matchid, matchdata in matches.items():
+            blob = None
+            if self.compact:
+                try:
+                    blob = matchcodec.encode(matchdata)
+                except ValueError:
+                    # doesn't fit the fixed fields, kept as json
+                    pass
+            matchpath = self.path(matchid, matchcodec.Extension if blob else '.gz')
+            os.makedirs(os.path.dirname(matchpath), exist_ok=True)
+            # write to a temporary file first, so concurrent readers never see a partial match
+            tmppath = "{path}.{pid}.{tid}".format(path=matchpath, pid=os.getpid(), tid=threading.get_ident())
+            if blob:
+                with open(tmppath, 'wb') as f:
+                    f.write(blob)
+            else:
+                with gzip.open(tmppath, 'wt+') as f:
+                    f.write(json.dumps(matchdata))
+            os.replace(tmppath, matchpath)
+
+    def __iter__(self):
+        """Yields (matchid, matchdata) of all cached matches"""
+        for dirpath, dirnames, filenames in os.walk(self.matchdir):
+            dirnames.sort()
+            matchids = set(int(filename[:-len(extension)]) for filename in filenames
+                           for extension in self.extensions if filename.endswith(extension))
+            for matchid in sorted(matchids):
+                yield matchid, self.load(matchid)
+
+
+class DbMatchStore(object):
+    """Stores every match as one row in the match table, the match data is a zlib compressed json blob
+       or in the compact matchcodec format. Date, game type and duration are extra indexed columns for
+       queries over all matches."""
+
+    # sqlite limits the number of variables in a statement
+    ChunkSize = 500
+
+    def __init__(self, connection, compact=False):
+        """connection is a callable returning the sqlite connection to use in the calling thread"""
+        self.connection = connection
+        self.compact = compact
+        self.db.executescript(MATCHDBCREATE)
+
+    @property
+    def db(self):
+        return self.connection()
+
+    @staticmethod
+    def encode(matchdata, compact=False):
+        if compact:
+            try:
+                return matchcodec.encode(matchdata)
+            except ValueError:
+                pass
+        return zlib.compress(json.dumps(matchdata, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def decode(blob, aid=None):
+        if matchcodec.isencoded(blob):
+            return matchcodec.decodeplayer(blob, aid) if aid is not None else matchcodec.decode(blob)
+        return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+    @staticmethod
+    def row(matchid, matchdata, compact=False):
+        match = Match(matchdata)
+        return {'id': matchid,
+                'date': match.gamedate(),
+                'gametype': match.gametype(),
+                'duration': int(match.gameduration().total_seconds()),
+                'data': DbMatchStore.encode(matchdata, compact)}
+
+    def cachedids(self, matchids):
+        matchids = list(matchids)
+        cached = set()
+        for i in range(0, len(matchids), DbMatchStore.ChunkSize):
+            chunk = matchids[i:i + DbMatchStore.ChunkSize]
+            cursor = self.db.execute("SELECT id FROM match WHERE id IN ({params})".format(
+                params=','.join('?' * len(chunk))), chunk)
+            cached.update(row[0] for row in cursor)
+        return cached
+
+    def load(self, matchid, aid=None):
+        row = self.db.execute("SELECT data FROM match WHERE id = :id", {'id': matchid}).fetchone()
+        if row:
+            return DbMatchStore.decode(row[0], aid)
+        return None
+
+    def storemany(self, matches):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO match VALUES(:id, :date, :gametype, :duration, :data);",
+                                [DbMatchStore.row(matchid, matchdata, self.compact)
+                                 for matchid, matchdata in matches.items()])
+
+    def __iter__(self):
+        for row in self.db.execute("SELECT id, data FROM match ORDER BY id"):
+            yield row[0], DbMatchStore.decode(row[1])
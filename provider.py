@@ -17,10 +17,21 @@ along with honstats.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import json
 import sqlite3
-import urllib.request
+from itertools import groupby
 from urllib.error import HTTPError
-import gzip
+from urllib.parse import quote
+import calendar
 import time
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import aggregate
+from httpclient import ConnectionPool, RateLimiter, retryafter, backoffdelay
+from matchstore import FileMatchStore, DbMatchStore
+from archive import MatchArchive
+from replay import ReplayData
+from datetimeutil import epoch
 
 DBCREATE = """
 CREATE TABLE IF NOT EXISTS player (
@@ -30,16 +41,73 @@ nick TEXT
 
 CREATE TABLE IF NOT EXISTS playerdata (
 id INTEGER,
-date DATETIME,
+date INTEGER,
 statstype TEXT,
 data TEXT,
-PRIMARY KEY(id, date, statstype)
-);
+PRIMARY KEY(id, statstype, date)
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS hero (
 id INTEGER PRIMARY KEY,
 name TEXT
 );
+
+CREATE TABLE IF NOT EXISTS refresh (
+name TEXT PRIMARY KEY,
+date INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS playermatch (
+account_id INTEGER,
+match_id INTEGER,
+hero_id INTEGER,
+team INTEGER,
+kills INTEGER,
+deaths INTEGER,
+assists INTEGER,
+wins INTEGER,
+losses INTEGER,
+gold INTEGER,
+wards INTEGER,
+duration INTEGER,
+PRIMARY KEY(account_id, match_id)
+);
+
+CREATE INDEX IF NOT EXISTS playermatch_match ON playermatch(match_id);
+CREATE INDEX IF NOT EXISTS playermatch_hero ON playermatch(account_id, hero_id, match_id);
+
+CREATE TABLE IF NOT EXISTS matchhistory (
+account_id INTEGER,
+statstype TEXT,
+match_id INTEGER,
+date INTEGER,
+mode INTEGER,
+PRIMARY KEY(account_id, statstype, match_id)
+);
+"""
+
+# schema changes of existing databases, PRAGMA user_version holds the number of migrations applied.
+# 1: playerdata dates as epoch, keyed by (id, statstype, date) so the newest snapshot is found with one seek
+MIGRATIONS = [
+"""
+ALTER TABLE playerdata RENAME TO playerdata_old;
+CREATE TABLE playerdata (
+id INTEGER,
+date INTEGER,
+statstype TEXT,
+data TEXT,
+PRIMARY KEY(id, statstype, date)
+) WITHOUT ROWID;
+INSERT OR REPLACE INTO playerdata SELECT id, CAST(strftime('%s', date) AS INTEGER), statstype, data FROM playerdata_old;
+DROP TABLE playerdata_old;
+"""
+]
+
+# temporary tables only exist in the connection that created them
+DBTEMPCREATE = """
+CREATE TEMP TABLE IF NOT EXISTS matchids (
+id INTEGER PRIMARY KEY
+);
 """
 
 
@@ -47,11 +115,43 @@ class NoResultsError(Exception):
     pass
 
 
+class LRUCache(object):
+    """Thread safe dict that holds at most maxsize items, dropping the least recently used"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
 class DataProvider(object):
     MatchCacheDir = 'match'
     PlayerCacheDir = 'player'
 
     CacheTime = 60 * 15
+    HeroCacheTime = 60 * 60 * 24 * 7
 
     HeroNicks = {
         6: "Devo",
@@ -88,41 +188,192 @@ class DataProvider(object):
             int(aid)
             return '/accountid/' + str(aid)
         except ValueError:
-            return '/nickname/' + aid
+            return '/nickname/' + quote(aid, safe='')
 
 
 class HttpDataProvider(DataProvider):
     StatsMapping = {'ranked': 'rnk', 'public': 'acc', 'casual': 'cs'}
 
-    def __init__(self, url='api.heroesofnewerth.com', token=None, cachedir="~/.honstats"):
+    MaxRetries = 5
+    LRUSize = 10000
+    PlayerHeroSortKeys = aggregate.HeroSortKeys
+    # downloaded matches are written to the match store in batches of this size
+    StoreBatchSize = 50
+    # maximum number of matches loaded or downloaded ahead of the consumer
+    MaxWindowSize = 200
+    # match store of matchstore 'archive', in the match cache directory
+    ArchiveFile = 'matches.hsa'
+    # seconds a connection waits for the write lock of another thread or process
+    DbTimeout = 30
+    # queued inserts are written in one transaction once there are this many
+    WriteBatchSize = 100
+
+    def __init__(self, url='api.heroesofnewerth.com', token=None, cachedir="~/.honstats", workers=1,
+                 poolsize=None, rate=0, retries=MaxRetries, matchstore='files', lrusize=LRUSize,
+                 matchformat='json'):
+        self.closed = False
         self.url = url
         self.token = token
+        self.workers = max(1, workers)
+        self.http = ConnectionPool(url, size=poolsize if poolsize else self.workers)
+        self.ratelimiter = RateLimiter(rate)
+        self.retries = retries
+        self.counters = Counter()
+        self.counterlock = threading.Lock()
+        # matches being downloaded by id, so concurrent players don't download the same match twice
+        self.inflight = {}
+        self.inflightlock = threading.Lock()
+        self.heroeslock = threading.Lock()
+        # a failed /heroes/all isn't requested again before this time
+        self.heroesretry = 0
+        self.writes = []
+        self.writelock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self.nicks = LRUCache(lrusize)
+        self.ids = LRUCache(lrusize)
+        self.heronames = LRUCache(lrusize)
         self.cachedir = os.path.abspath(os.path.expanduser(cachedir))
         if self.cachedir:
             os.makedirs(self.cachedir, exist_ok=True)
-            dbfile = os.path.join(self.cachedir, 'stats.db')
-            self.db = sqlite3.connect(dbfile)
+            self.dbfile = os.path.join(self.cachedir, 'stats.db')
+            self.local = threading.local()
+            # the connection of every thread by thread, so close can close them all
+            self.connections = {}
+            self.connectionslock = threading.Lock()
+            # the journal mode is stored in the database file, readers don't block the writer with WAL
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.migrate()
             self.db.executescript(DBCREATE)
 
-            os.makedirs(os.path.join(self.cachedir, DataProvider.MatchCacheDir), exist_ok=True)
+            matchdir = os.path.join(self.cachedir, DataProvider.MatchCacheDir)
+            os.makedirs(matchdir, exist_ok=True)
             os.makedirs(os.path.join(self.cachedir, DataProvider.PlayerCacheDir), exist_ok=True)
 
+            self.compact = matchformat == 'compact'
+            self.filematchstore = FileMatchStore(matchdir, compact=self.compact)
+            if matchstore == 'db':
+                self.matchstore = DbMatchStore(lambda: self.db, compact=self.compact)
+            elif matchstore == 'archive':
+                self.matchstore = MatchArchive(os.path.join(matchdir, HttpDataProvider.ArchiveFile))
+            else:
+                self.matchstore = self.filematchstore
+            self.preload()
+
     def __del__(self):
-        self.db.close()
+        self.close()
+
+    def close(self):
+        """Writes the queued inserts and closes the connections of all threads, only the first call does"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.cachedir:
+            self.flush()
+        if self.executor:
+            # the workers are idle after the commands, but none may use a connection while it is closed
+            self.executor.shutdown(wait=True)
+        self.http.close()
+        if self.cachedir:
+            with self.connectionslock:
+                connections, self.connections = list(self.connections.values()), {}
+            for db in connections:
+                db.close()
+            self.local = threading.local()
+
+    @property
+    def db(self):
+        """The sqlite connection of the calling thread, connections can't be shared between threads"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # only used by its thread, but close closes it from the closing thread
+            db = sqlite3.connect(self.dbfile, timeout=HttpDataProvider.DbTimeout, check_same_thread=False)
+            # in WAL mode commits are only synced to disk at checkpoints, a crash can lose the last
+            # commits but never corrupts the cache
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(DBTEMPCREATE)
+            self.local.db = db
+            with self.connectionslock:
+                # connections of threads that ended, e.g. the request threads of honstats serve
+                for thread in [thread for thread in self.connections if not thread.is_alive()]:
+                    self.connections.pop(thread).close()
+                self.connections[threading.current_thread()] = db
+        return db
+
+    def migrate(self):
+        """Applies the MIGRATIONS missing in the database, a new database is created with the current schema"""
+        if self.db.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+        # another process may migrate at the same time, take the write lock before looking again
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if not self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'playerdata'").fetchone():
+                version = len(MIGRATIONS)
+            for migration in MIGRATIONS[version:]:
+                for statement in migration.split(';'):
+                    if statement.strip():
+                        self.db.execute(statement)
+            self.db.execute("PRAGMA user_version = {version}".format(version=len(MIGRATIONS)))
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+
+    def queuewrite(self, sql, params):
+        """Queues a single row insert, queued inserts are written in one transaction by flush"""
+        with self.writelock:
+            self.writes.append((sql, params))
+            full = len(self.writes) >= HttpDataProvider.WriteBatchSize
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes the queued inserts, consecutive inserts of the same statement with executemany"""
+        with self.writelock:
+            writes, self.writes = self.writes, []
+        if writes:
+            with self.db:
+                for sql, group in groupby(writes, key=lambda write: write[0]):
+                    self.db.executemany(sql, [params for sql_, params in group])
+            self.count('db_flushes')
+
+    def count(self, name, n=1):
+        with self.counterlock:
+            self.counters[name] += n
+
+    def imap(self, func, items):
+        """Calls func for every item, concurrently if more than one worker is configured.
+           Returns an iterator yielding the results in the order of items."""
+        if self.executor and len(items) > 1:
+            return self.executor.map(func, items)
+        return map(func, items)
+
+    def preload(self):
+        """Fills the lookup caches from the player and hero tables"""
+        for aid, nick in self.db.execute("SELECT id, nick FROM player LIMIT :size", {'size': self.nicks.maxsize}):
+            self.nicks.put(aid, nick)
+            self.ids.put(nick.lower(), aid)
+        for aid, name in self.db.execute("SELECT id, name FROM hero"):
+            self.heronames.put(aid, name)
 
     def nick2id(self, nick):
         try:
             int(nick)
         except ValueError:
+            aid = self.ids.get(nick.lower())
+            if aid is not None:
+                return aid
             cursor = self.db.cursor()
             cursor.execute("SELECT id from player WHERE lower(nick) = lower(:nick)", {'nick': nick})
             row = cursor.fetchone()
             cursor.close()
             if row:
+                self.ids.put(nick.lower(), int(row[0]))
                 return int(row[0])
-            data = self.fetch('/player_statistics/ranked/nickname/' + nick)
+            data = self.fetch('/player_statistics/ranked/nickname/' + quote(nick, safe=''))
             # insert the real nick into database, case sensitiv
             self.id2nick(int(data['account_id']))
+            self.ids.put(nick.lower(), int(data['account_id']))
             return int(data['account_id'])
         return int(nick)
 
@@ -134,164 +385,569 @@ class HttpDataProvider(DataProvider):
 #            m = re.search(r'<title>View Profile:\s*(\S+)-', begin)
 #            if m:
 #                return m.group(1)
+            nick = self.nicks.get(aid)
+            if nick is not None:
+                return nick
             cursor = self.db.cursor()
             cursor.execute("SELECT nick FROM player WHERE id = :id", {'id': aid})
             row = cursor.fetchone()
             cursor.close()
             if row:
+                self.nicks.put(aid, row[0])
                 return row[0]
 
             data = self.fetch('/player_statistics/ranked/accountid/' + str(aid))
 
-            self.db.execute('INSERT INTO player VALUES( :id, :nick );', {'id': aid, 'nick': data['nickname']})
-            self.db.commit()
+            self.queuewrite('INSERT OR REPLACE INTO player VALUES( :id, :nick );',
+                            {'id': aid, 'nick': data['nickname']})
+            self.nicks.put(aid, data['nickname'])
             return data['nickname']
 
         return str(aid)
 
+    def id2nicks(self, aids):
+        """Resolves many account ids with one query, unknown players are fetched concurrently
+
+           Returns:
+             dict of account id to nickname
+        """
+        nicks = {}
+        missing = []
+        for aid in aids:
+            nick = self.nicks.get(int(aid))
+            if nick is not None:
+                nicks[int(aid)] = nick
+            else:
+                missing.append(int(aid))
+
+        if missing:
+            cursor = self.db.execute("SELECT id, nick FROM player WHERE id IN ({params})".format(
+                params=','.join('?' * len(missing))), missing)
+            for aid, nick in cursor:
+                nicks[aid] = nick
+                self.nicks.put(aid, nick)
+
+            unknown = [aid for aid in missing if aid not in nicks]
+            fetched = self.imap(self.fetchnick, unknown)
+            rows = [{'id': aid, 'nick': nick} for aid, nick in zip(unknown, fetched) if nick is not None]
+            if rows:
+                with self.db:
+                    self.db.executemany('INSERT OR REPLACE INTO player VALUES( :id, :nick );', rows)
+                for row in rows:
+                    nicks[row['id']] = row['nick']
+                    self.nicks.put(row['id'], row['nick'])
+            for aid in unknown:
+                nicks.setdefault(aid, str(aid))
+        return nicks
+
+    def fetchnick(self, aid):
+        """Returns the nickname of the account or None if the API doesn't know it"""
+        try:
+            return self.fetch('/player_statistics/ranked/accountid/' + str(aid))['nickname']
+        except NoResultsError:
+            return None
+
     def heroid2name(self, aid, full=False):
+        aid = int(aid)
         if not full and aid in DataProvider.HeroNicks:
             return DataProvider.HeroNicks[aid]
+        name = self.heronames.get(aid)
+        if name is not None:
+            return name
         cursor = self.db.cursor()
         cursor.execute("SELECT name FROM hero WHERE id = :id", {'id': aid})
         row = cursor.fetchone()
         cursor.close()
         if row:
+            self.heronames.put(aid, row[0])
             return row[0]
-        data = self.fetch('/heroes/id/{id}'.format(id=aid))
+        if self.refreshheroes():
+            name = self.heronames.get(aid)
+            if name is not None:
+                return name
+        # only heroes missing in /heroes/all are fetched one by one
+        try:
+            data = self.fetch('/heroes/id/{id}'.format(id=aid))
+        except NoResultsError:
+            # show the id of heroes the api doesn't know, remembered so it isn't asked for every match
+            self.heronames.put(aid, str(aid))
+            return str(aid)
         name = data['disp_name'].strip()
-        self.db.execute('INSERT INTO hero VALUES( :id, :name);',  {'id': aid, 'name': name})
-        self.db.commit()
+        self.queuewrite('INSERT OR REPLACE INTO hero VALUES( :id, :name);', {'id': aid, 'name': name})
+        self.heronames.put(aid, name)
         return name
 
     def fetch(self, path):
-        url = self.url + path + "/?token=" + self.token
+        url = path + "/?token=" + self.token
         #print(url)
-        try:
-            resp = urllib.request.urlopen(url)
-        except HTTPError as e:
-            if e.code == 404:
+        for attempt in range(self.retries + 1):
+            self.ratelimiter.acquire()
+            resp = self.http.get(url)
+            self.count('requests')
+            if resp.status != 429:  # too much requests
+                break
+            self.count('throttled')
+            if attempt < self.retries:
+                self.count('retried')
+                # make all threads back off, not only this one
+                delay = retryafter(resp.headers)
+                self.ratelimiter.pause(delay if delay is not None else backoffdelay(attempt))
+
+        if resp.status != 200:
+            if resp.status == 404:
                 raise NoResultsError()
-            if e.code == 429:  # too much requests
-                time.sleep(0.1)  # this might be a bit harsh, but fetch until we get what we want
-                return self.fetch(path)
-            raise e
-        raw = resp.read().decode('utf-8').strip()
+            raise HTTPError(self.url + url, resp.status, resp.reason, resp.headers, None)
+        self.count('bytes', len(resp.body))
+        raw = resp.body.decode('utf-8').strip()
 
         # work around a serialization bug from hon
         if raw.startswith('Notice:'):
             raw = raw[raw.find('\n'):]
         data = json.loads(raw)
-        resp.close()
         return data
 
     def fetchplayer(self, aid, statstype):
-        cursor = self.db.cursor()
-        cursor.execute("SELECT data FROM playerdata WHERE id=:id AND "
-                       "strftime('%s',date)-:date>0 AND statstype=:statstype ORDER BY date;",
-                       {'id': self.nick2id(aid), 'date': int(time.time() - DataProvider.CacheTime),
-                        'statstype': statstype})
-        row = cursor.fetchone()
-        cursor.close()
-        if row:
-            return json.loads(row[0])
+        """Returns the newest stats snapshot of the player if it is younger than CacheTime, else fetches it.
+           A fetched snapshot only adds a row if the player played since the newest one, otherwise the
+           newest snapshot is replaced."""
+        playerid = self.nick2id(aid)
+        row = self.db.execute("SELECT date, data FROM playerdata WHERE id=:id AND statstype=:statstype "
+                              "ORDER BY date DESC LIMIT 1;", {'id': playerid, 'statstype': statstype}).fetchone()
+        now = int(time.time())
+        if row and row[0] > now - DataProvider.CacheTime:
+            return json.loads(row[1])
         data = self.fetch('/player_statistics/' + statstype + DataProvider.nickoraccountid(aid))
 
-#        # check if the data really changed
-#        cursor = self.db.cursor()
-#        cursor.execute("SELECT data FROM playerdata WHERE id=:id AND statstype=:statstype " \
-#                       "AND strftime('%s', date)=(select MAX(strftime('%s',date)) " \
-#                       "from playerdata WHERE id=:id AND statstype=:statstype);",
-#                       {'id': self.nick2id(id), 'date': int(time.time() - DataProvider.CacheTime),
-#                       'statstype': statstype})
-#        dbdata = json.loads(cursor.fetchone()[0])
-#        # insert if we have more games
-#        if int(dbdata[self.StatsMapping[statstype] + '_games_played']) !=
-#           int(data[self.StatsMapping[statstype] + '_games_played']):
-        if True:
-            self.db.execute("INSERT INTO playerdata VALUES(:id, CURRENT_TIMESTAMP, :statstype, :data);",
-                            {'id': self.nick2id(aid), 'statstype': statstype, 'data': json.dumps(data)})
-            self.db.commit()
-
+        played = self.StatsMapping[statstype] + '_games_played'
+        with self.db:
+            if row and json.loads(row[1]).get(played) == data.get(played):
+                self.db.execute("UPDATE playerdata SET date=:now, data=:data WHERE id=:id AND statstype=:statstype "
+                                "AND date=:date;", {'id': playerid, 'statstype': statstype, 'date': row[0],
+                                                    'now': now, 'data': json.dumps(data)})
+            else:
+                self.db.execute("INSERT OR REPLACE INTO playerdata VALUES(:id, :now, :statstype, :data);",
+                                {'id': playerid, 'statstype': statstype, 'now': now, 'data': json.dumps(data)})
         return data
 
+    def compactplayerdata(self, interval=24, retention=0):
+        """Keeps only the newest player snapshot per interval hours and drops the snapshots older than
+           retention days, 0 keeps all. The newest snapshot of every player and statstype is always kept.
+
+           Returns:
+             number of removed snapshots
+        """
+        with self.db:
+            removed = self.db.execute("DELETE FROM playerdata WHERE EXISTS "
+                                      "(SELECT 1 FROM playerdata AS newer WHERE newer.id = playerdata.id "
+                                      "AND newer.statstype = playerdata.statstype "
+                                      "AND newer.date / :interval = playerdata.date / :interval "
+                                      "AND newer.date > playerdata.date);",
+                                      {'interval': max(1, int(interval * 60 * 60))}).rowcount
+            if retention:
+                removed += self.db.execute("DELETE FROM playerdata WHERE date < :cutoff AND date < "
+                                           "(SELECT MAX(date) FROM playerdata AS newest WHERE "
+                                           "newest.id = playerdata.id AND newest.statstype = playerdata.statstype);",
+                                           {'cutoff': int(time.time()) - retention * 60 * 60 * 24}).rowcount
+        return removed
+
+    def vacuum(self):
+        """Rebuilds stats.db to give the space of removed rows back to the file system"""
+        self.flush()
+        self.db.execute("VACUUM")
+
     def fetchmatches(self, aid, statstype):
-        playerdir = os.path.join(self.cachedir,  DataProvider.PlayerCacheDir)
-        playermatches = os.path.join(playerdir, "{id}_matches_{statstype}.gz".format(
-            id=self.nick2id(aid),
-            statstype=statstype))
-        if os.path.exists(playermatches) and os.stat(playermatches).st_ctime > time.time() - DataProvider.CacheTime:
-            with gzip.open(playermatches, 'rt') as f:
-                data = json.load(f)
-        else:
-            path = '/match_history/' + statstype + DataProvider.nickoraccountid(aid)
-            data = self.fetch(path)
-            with gzip.open(playermatches, 'wt+') as f:
-                f.write(json.dumps(data))
-        return data
+        return self.fetch('/match_history/' + statstype + DataProvider.nickoraccountid(aid))
+
+    @staticmethod
+    def parsehistory(data):
+        """Parses a /match_history/ response, the history is a comma separated list of matchid|mode|mm/dd/yyyy
+
+           Returns:
+             list of (matchid, date, mode) tuples, date is the epoch of the day the match was played
+        """
+        rows = []
+        history = data[0]['history'] if data else ''
+        for entry in history.split(','):
+            if not entry:
+                continue
+            parts = entry.split('|')
+            mode = int(parts[1]) if len(parts) > 1 and parts[1] else None
+            date = None
+            if len(parts) > 2 and parts[2]:
+                month, day, year = parts[2].split('/')
+                date = calendar.timegm((int(year), int(month), int(day), 0, 0, 0))
+            rows.append((int(parts[0]), date, mode))
+        return rows
+
+    def synchistory(self, aid, statstype):
+        """Merges the match history of a player from the API into the matchhistory table.
+           The API always returns the full history, only the match ids that aren't known yet are written.
+           Downloading the new matches is left to the caller, see sync.syncplayer.
+
+           Returns:
+             list of the new match ids, newest first
+        """
+        aid = self.nick2id(aid)
+        history = HttpDataProvider.parsehistory(self.fetchmatches(aid, statstype))
+        known = set(row[0] for row in self.db.execute(
+            "SELECT match_id FROM matchhistory WHERE account_id = :id AND statstype = :statstype",
+            {'id': aid, 'statstype': statstype}))
+        new = [row for row in history if row[0] not in known]
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO matchhistory VALUES(:id, :statstype, :matchid, :date, :mode);",
+                                [{'id': aid, 'statstype': statstype, 'matchid': matchid, 'date': date, 'mode': mode}
+                                 for matchid, date, mode in new])
+            self.db.execute("INSERT OR REPLACE INTO refresh VALUES(:name, :date);",
+                            {'name': HttpDataProvider.historyrefresh(aid, statstype), 'date': int(time.time())})
+        self.count('history_new', len(new))
+
+        return sorted((row[0] for row in new), reverse=True)
+
+    @staticmethod
+    def historyrefresh(aid, statstype):
+        """Name of the refresh table row holding the last history sync of a player"""
+        return 'history/{statstype}/{id}'.format(statstype=statstype, id=aid)
 
     def matches(self, aid, statstype):
-        data = self.fetchmatches(aid, statstype)
-        history = ""
-        if len(data) > 0:
-            history = data[0]['history']
-        hist = history.split(',')
-        matchids = [int(x.split('|')[0]) for x in hist]
-        matchids = sorted(matchids, reverse=True)
-        return matchids
+        """Returns the match ids of a player, newest first. The history is synced if it is older than CacheTime."""
+        aid = self.nick2id(aid)
+        row = self.db.execute("SELECT date FROM refresh WHERE name = :name",
+                              {'name': HttpDataProvider.historyrefresh(aid, statstype)}).fetchone()
+        if not row or row[0] <= time.time() - DataProvider.CacheTime:
+            # only the ids, the commands download the matches they show
+            self.synchistory(aid, statstype)
+        return [row[0] for row in self.db.execute(
+            "SELECT match_id FROM matchhistory WHERE account_id = :id AND statstype = :statstype "
+            "ORDER BY match_id DESC", {'id': aid, 'statstype': statstype})]
+
+    def fetchmatch(self, matchid):
+        """Downloads a match, returns None if the match doesn't exist.
+           Doesn't write to the database or the match store, so it is safe to call from worker threads.
+           Matches another thread downloaded, is downloading or stored meanwhile aren't downloaded again."""
+        with self.inflightlock:
+            future = self.inflight.get(matchid)
+            owner = future is None
+            if owner:
+                future = self.inflight[matchid] = Future()
+        if not owner:
+            self.count('inflight_hits')
+            return future.result()
+        try:
+            # another thread may have stored it since the caller looked into the match store
+            if self.matchstore.cachedids([matchid]):
+                self.count('inflight_hits')
+                matchdata = self.matchstore.load(matchid)
+            else:
+                matchdata = self.downloadmatch(matchid)
+        except BaseException as e:
+            future.set_exception(e)
+            with self.inflightlock:
+                del self.inflight[matchid]
+            raise
+        # kept until storematches wrote it
+        future.set_result(matchdata)
+        return matchdata
+
+    def downloadmatch(self, matchid):
+        try:
+            matchdata = self.fetch('/match/summ/matchid/{id}'.format(id=matchid))
+            matchstats = self.fetch('/match/all/matchid/{id}'.format(id=matchid))
+        except NoResultsError:
+            return None
+        matchdata.append(matchstats[0][0])  # settings
+        matchdata.append(matchstats[1])  # items
+        matchdata.append(matchstats[2])  # player stats
+        # parsed once here, the match stores keep it
+        matchdata[0]['mdt_epoch'] = epoch(matchdata[0]['mdt'])
+        return matchdata
+
+    def storematches(self, matches):
+        """Writes downloaded matches into the match store in one batch"""
+        matchids = list(matches)
+        matches = {matchid: matchdata for matchid, matchdata in matches.items() if matchdata}
+        if matches:
+            self.matchstore.storemany(matches)
+            self.indexmatches(matches)
+        with self.inflightlock:
+            for matchid in matchids:
+                self.inflight.pop(matchid, None)
+        self.flush()
+        return matches
+
+    @staticmethod
+    def playermatchrows(matchid, matchdata):
+        duration = int(matchdata[0]['time_played'])
+        for stats in matchdata[3]:
+            yield {'account_id': int(stats['account_id']),
+                   'match_id': matchid,
+                   'hero_id': int(stats['hero_id']),
+                   'team': int(stats['team']),
+                   'kills': int(stats['herokills']),
+                   'deaths': int(stats['deaths']),
+                   'assists': int(stats['heroassists']),
+                   'wins': int(stats['wins']),
+                   'losses': int(stats['losses']),
+                   'gold': int(stats['gold']),
+                   'wards': int(stats['wards']),
+                   'duration': duration}
+
+    def indexmatches(self, matches):
+        """Extracts the player stats of matches into the playermatch table"""
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO playermatch VALUES(:account_id, :match_id, :hero_id, "
+                                ":team, :kills, :deaths, :assists, :wins, :losses, :gold, :wards, :duration);",
+                                [row for matchid, matchdata in matches.items() if matchdata
+                                 for row in HttpDataProvider.playermatchrows(matchid, matchdata)])
+
+    def setmatchids(self, matchids):
+        """Fills the temporary matchids table, to be used in queries instead of huge IN lists"""
+        # committed right away, an open transaction would keep the database locked for other threads
+        with self.db:
+            self.db.execute("DELETE FROM temp.matchids;")
+            self.db.executemany("INSERT OR IGNORE INTO temp.matchids VALUES(?);",
+                                [(matchid,) for matchid in matchids])
+
+    def playerherostats(self, aid, matchids, sortby='use', order='asc'):
+        """Aggregates the stats of a player per hero over the given matches.
+           Matches that aren't in the playermatch table yet are loaded (or downloaded) and indexed first.
+
+           Returns:
+             list of dicts with the summed and derived stats per hero, sorted by sortby
+        """
+        if sortby not in HttpDataProvider.PlayerHeroSortKeys:
+            raise ValueError("Unknown sort key: " + sortby)
+        aid = self.nick2id(aid)
+        self.setmatchids(matchids)
+        indexed = set(row[0] for row in self.db.execute(
+            "SELECT match_id FROM playermatch WHERE account_id = :id AND match_id IN (SELECT id FROM temp.matchids)",
+            {'id': aid}))
+        missing = [matchid for matchid in matchids if matchid not in indexed]
+        if missing:
+            # downloaded matches are indexed by storematches, this catches the ones cached before
+            self.indexmatches(dict(self.itermatchdata(missing)))
+            self.setmatchids(matchids)
+
+        columns = aggregate.Columns(aggregate.MatchFields, self.db.execute(
+            "SELECT {fields} FROM playermatch WHERE account_id = :id AND match_id IN (SELECT id FROM temp.matchids)"
+            .format(fields=', '.join(aggregate.MatchFields)), {'id': aid}))
+        return aggregate.herostats(columns, len(matchids), sortby, order)
 
     def fetchmatchdata(self, matchids, *, limit=None, id_hero=None):
         """Fetches match data by id and caches it onto disk
-           First checks if the match stats are already cached
-
-           Args:
-             matchids: list of match ids
+           First checks if the match stats are already cached, missing matches
+           are downloaded concurrently in windows of `workers` matches.
+           See itermatchdata for the arguments.
 
            Returns:
              dict with matches, the key is the matchid
         """
-        data = {}
+        return dict(self.itermatchdata(matchids, limit=limit, id_hero=id_hero))
+
+    def itermatchdata(self, matchids, *, limit=None, id_hero=None, player=None):
+        """Generator version of fetchmatchdata, yields matches in the order of matchids
+           as soon as they are loaded or downloaded.
+
+           Args:
+             matchids: list of match ids
+             limit: stop after this many matches were found
+             id_hero: tuple of (player, heroname), only return matches where
+                      the player played a hero containing heroname
+             player: account id of the only player whose stats are needed, cached compact
+                     matches are then decoded partially, see matchcodec.decodeplayer
+
+           Yields:
+             tuples of (matchid, matchdata), matchdata is None if the match doesn't exist
+        """
+        matchids = [int(matchid) for matchid in matchids]
+        found = 0
         limit = limit if limit else len(matchids)
         heroname = None
         aid = None
+        unindexed = {}
         if id_hero:
             aid, heroname = id_hero
             aid = self.nick2id(aid)
+            heroids, knownheroes = self.heroids(heroname)
+            matchids, indexed = self.heromatches(aid, heroids, knownheroes, matchids)
+            # we can't know how many matches are needed, so only fetch ahead one window
+            windowsize = self.workers
+        else:
+            # bounded, so the matches waiting to be consumed don't grow with the limit
+            windowsize = min(limit, HttpDataProvider.MaxWindowSize)
 
         i = 0
-        while len(data) < limit and i < len(matchids):
-            matchid = matchids[i]
-            matchdir = os.path.join(self.cachedir,  DataProvider.MatchCacheDir)
-            matchpath = os.path.join(matchdir, str(matchid)[0:4])
-            os.makedirs(matchpath, exist_ok=True)
-            matchpath = os.path.join(matchpath, str(matchid) + ".gz")
-            if os.path.exists(matchpath):
-                with gzip.open(matchpath, 'rt') as f:
-                    matchdata = json.load(f)
-            else:
-                try:
-                    matchdata = self.fetch('/match/summ/matchid/{id}'.format(id=matchid))
-                    matchstats = self.fetch('/match/all/matchid/{id}'.format(id=matchid))
-                    matchdata.append(matchstats[0][0])  # settings
-                    matchdata.append(matchstats[1])  # items
-                    matchdata.append(matchstats[2])  # player stats
-                    with gzip.open(matchpath, 'wt+') as f:
-                        f.write(json.dumps(matchdata))
-                except NoResultsError:
-                    matchdata = None
-
-            if id_hero and matchdata:
-                playerstats = matchdata[3]
-                for stats in playerstats:
-                    if aid == int(stats['account_id']):
-                        playedhero = self.heroid2name(stats['hero_id'], full=True).lower()
-                        if heroname in playedhero:
-                            data[matchid] = matchdata
+        pending = {}
+        # downloads started ahead of the consumer, by matchid
+        futures = {}
+        try:
+            while found < limit and i < len(matchids):
+                # every match yields at most one hit, so never read ahead further than needed
+                window = matchids[i:i + min(windowsize, limit - found)]
+                cached = self.matchstore.cachedids(window)
+                self.count('matchcache_hits', len(cached))
+                self.count('matchcache_misses', len(window) - len(cached))
+                missing = [matchid for matchid in window if matchid not in cached]
+                # with workers the downloads start right away, results are picked up in order below
+                if self.executor and len(missing) > 1:
+                    futures = {matchid: self.executor.submit(self.fetchmatch, matchid) for matchid in missing}
+
+                for matchid in window:
+                    if found >= limit:
                         break
-            else:
-                data[matchid] = matchdata
-            i += 1
-        return data
+                    if matchid in cached:
+                        # unindexed matches of the hero search are indexed, they need all players
+                        matchdata = self.matchstore.load(matchid, aid=None if id_hero else player)
+                        if id_hero and matchdata and matchid not in indexed:
+                            unindexed[matchid] = matchdata
+                            if len(unindexed) >= HttpDataProvider.StoreBatchSize:
+                                self.indexmatches(unindexed)
+                                unindexed = {}
+                    else:
+                        future = futures.pop(matchid, None)
+                        matchdata = future.result() if future else self.fetchmatch(matchid)
+                        pending[matchid] = matchdata
+                        if len(pending) >= HttpDataProvider.StoreBatchSize:
+                            self.storematches(pending)
+                            pending = {}
+                    if id_hero and matchdata:
+                        playerstats = matchdata[3]
+                        for stats in playerstats:
+                            if aid == int(stats['account_id']):
+                                heroid = int(stats['hero_id'])
+                                if heroid in heroids or (heroid not in knownheroes and
+                                                         heroname in self.heroid2name(heroid, full=True).lower()):
+                                    found += 1
+                                    yield matchid, matchdata
+                                break
+                    else:
+                        found += 1
+                        yield matchid, matchdata
+                i += len(window)
+        finally:
+            # if the caller stops early, downloads that didn't start are cancelled and the others
+            # stored, storematches also drops them from inflight
+            started = [(matchid, future) for matchid, future in futures.items() if not future.cancel()]
+            for matchid, future in started:
+                try:
+                    pending[matchid] = future.result()
+                except Exception:
+                    # fetchmatch dropped the failed download from inflight
+                    pass
+            self.storematches(pending)
+            self.indexmatches(unindexed)
+
+    def heroids(self, heroname):
+        """Resolves a part of a hero name to hero ids
+
+           Returns:
+             tuple of (ids of the heroes whose name contains heroname, ids of all heroes in the hero table)
+        """
+        # without /heroes/all the heroes that aren't in the hero table are checked by heroid2name
+        self.refreshheroes()
+        self.flush()
+        heroes = self.db.execute("SELECT id, name FROM hero").fetchall()
+        return set(aid for aid, name in heroes if heroname in name.lower()), set(aid for aid, name in heroes)
+
+    def heromatches(self, aid, heroids, knownheroes, matchids):
+        """Uses the playermatch table to drop the matches where the player played another known hero
+
+           Returns:
+             tuple of (matchids that can contain the heroes, in the order of matchids, set of the indexed matchids)
+        """
+        # covered by the playermatch_hero index
+        played = dict(self.db.execute("SELECT match_id, hero_id FROM playermatch WHERE account_id = :id",
+                                      {'id': aid}))
+        candidates = [matchid for matchid in matchids
+                      if matchid not in played or played[matchid] in heroids or played[matchid] not in knownheroes]
+        return candidates, set(matchid for matchid in matchids if matchid in played)
+
+    def importmatches(self):
+        """Copies all matches of the gzip file cache into the match database, or the match archive if that
+           is the match store, and the playermatch table. Matches that are already there are skipped.
+
+           Returns:
+             number of imported matches
+        """
+        store = self.matchstore
+        if isinstance(store, FileMatchStore):
+            store = DbMatchStore(lambda: self.db, compact=self.compact)
+        imported = 0
+        batch = {}
+        for matchid, matchdata in self.filematchstore:
+            batch[matchid] = matchdata
+            if len(batch) >= DbMatchStore.ChunkSize:
+                imported += self.importbatch(store, batch)
+                batch = {}
+        return imported + self.importbatch(store, batch)
+
+    def importbatch(self, store, batch):
+        cached = store.cachedids(batch)
+        batch = {matchid: matchdata for matchid, matchdata in batch.items() if matchid not in cached}
+        store.storemany(batch)
+        self.indexmatches(batch)
+        return len(batch)
+
+    def storeheroes(self, heroesdata):
+        """Writes the names of a /heroes/all response into the hero table"""
+        rows = [{'id': int(heroid), 'name': hero['disp_name'].strip()} for heroid, hero in heroesdata.items()]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO hero VALUES( :id, :name);', rows)
+            self.db.execute("INSERT OR REPLACE INTO refresh VALUES('heroes', :date);", {'date': int(time.time())})
+        for row in rows:
+            self.heronames.put(row['id'], row['name'])
+
+    def refreshheroes(self):
+        """Loads all hero names with one request, if they weren't loaded within HeroCacheTime.
+           If the request fails the names are looked up one by one, it is tried again after CacheTime.
+
+           Returns:
+             True if the hero names were refreshed
+        """
+        # one thread refreshes, the others wait and find the fresh names
+        with self.heroeslock:
+            if self.heroesretry > time.time():
+                return False
+            row = self.db.execute("SELECT date FROM refresh WHERE name = 'heroes'").fetchone()
+            if row and row[0] > time.time() - DataProvider.HeroCacheTime:
+                return False
+            try:
+                data = self.fetch('/heroes/all')
+            except (NoResultsError, OSError, ValueError):
+                # HTTPError is an OSError, ValueError a broken response
+                self.heroesretry = time.time() + DataProvider.CacheTime
+                return False
+            self.storeheroes(data)
+            return True
 
     def heroes(self):
-        return self.fetch('/heroes/all')
+        """Returns the /heroes/all response, or the heroes of the hero table if the API has none"""
+        try:
+            data = self.fetch('/heroes/all')
+        except NoResultsError:
+            self.flush()
+            return {str(aid): {'hero_id': str(aid), 'disp_name': name}
+                    for aid, name in self.db.execute("SELECT id, name FROM hero")}
+        self.storeheroes(data)
+        return data
+
+
+class FileDataProvider(HttpDataProvider):
+    """Answers API requests from recorded responses in a directory laid out by API path, like sampledata/.
+       Every request is delayed by latency seconds to simulate the network, caching works like
+       with HttpDataProvider."""
+
+    def __init__(self, datadir, latency=0, **kwargs):
+        self.replay = ReplayData(datadir)
+        self.latency = latency
+        HttpDataProvider.__init__(self, url='file://' + self.replay.datadir, **kwargs)
+
+    def fetch(self, path):
+        self.ratelimiter.acquire()
+        if self.latency:
+            time.sleep(self.latency)
+        self.count('requests')
+        body = self.replay.read(path)
+        if body is None:
+            raise NoResultsError()
+        self.count('bytes', len(body))
+        return json.loads(body.decode('utf-8'))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Replays recorded Heroes of Newerth API responses
+
+The data directory is laid out by API path, like sampledata/:
+match_history/ranked/nickname/erpe, match/all/matchid/112026229, ...
+Run as script it serves the directory over HTTP, so honstats can be
+pointed at it with --host:
+
+  python3 replay.py sampledata --port 8765 --latency 0.05
+
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import argparse
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class ReplayData(object):
+    """Reads API responses from datadir. Player data recorded by nickname is
+       also answered for /accountid/ requests, like the API does."""
+
+    def __init__(self, datadir):
+        self.datadir = os.path.abspath(os.path.expanduser(datadir))
+        self.accounts = {}
+        for section in ('player_statistics', 'match_history'):
+            sectiondir = os.path.join(self.datadir, section)
+            if not os.path.isdir(sectiondir):
+                continue
+            for statstype in os.listdir(sectiondir):
+                nickdir = os.path.join(sectiondir, statstype, 'nickname')
+                if os.path.isdir(nickdir):
+                    for nick in os.listdir(nickdir):
+                        self.indexaccount(os.path.join(nickdir, nick), nick)
+
+    def indexaccount(self, path, nick):
+        with open(path) as f:
+            data = json.load(f)
+        # match history is a list with one entry
+        data = data[0] if isinstance(data, list) and data else data
+        if isinstance(data, dict) and 'account_id' in data:
+            self.accounts[int(data['account_id'])] = nick
+
+    def filepath(self, path):
+        parts = [unquote(part) for part in path.split('/') if part]
+        if any(part in ('.', '..') or '/' in part or os.sep in part for part in parts):
+            return None
+        return os.path.join(self.datadir, *parts)
+
+    def read(self, path):
+        """Returns the raw response body for an API path or None if there is no recorded response"""
+        filepath = self.filepath(path)
+        if filepath and os.path.isfile(filepath):
+            with open(filepath, 'rb') as f:
+                return f.read()
+
+        parts = [part for part in path.split('/') if part]
+        if len(parts) == 4 and parts[2] == 'accountid' and parts[3].isdigit() and int(parts[3]) in self.accounts:
+            nick = self.accounts[int(parts[3])]
+            body = self.read('/'.join(parts[:2] + ['nickname', nick]))
+            if body and parts[0] == 'player_statistics':
+                data = json.loads(body.decode('utf-8'))
+                data.setdefault('nickname', nick)
+                body = json.dumps(data).encode('utf-8')
+            return body
+        return None
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.server.data.read(self.path.split('?')[0])
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """HTTP stub of the API answering from a ReplayData directory, every request is delayed by latency seconds"""
+    daemon_threads = True
+
+    def __init__(self, address, datadir, latency=0, quiet=True):
+        ThreadingHTTPServer.__init__(self, address, ReplayHandler)
+        self.data = ReplayData(datadir)
+        self.latency = latency
+        self.quiet = quiet
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serve recorded honstats API responses')
+    parser.add_argument('datadir', help='directory with the recorded responses, e.g. sampledata')
+    parser.add_argument('-b', '--bind', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-p', '--port', default=8765, type=int, help='port to listen on')
+    parser.add_argument('--latency', default=0, type=float, help='seconds every response is delayed')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log requests')
+    args = parser.parse_args()
+
+    server = ReplayServer((args.bind, args.port), args.datadir, latency=args.latency, quiet=not args.verbose)
+    sys.stderr.write("replaying {datadir} on http://{host}:{port}/\n".format(
+        datadir=server.data.datadir, host=args.bind, port=server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+from provider import NoResultsError, LRUCache
+
+
+def validarg(arg):
+    """Nicks and ids end up in API paths, so they must not contain path or query separators"""
+    if not arg or arg in ('.', '..'):
+        return False
+    return not any(c in '/?#\\' or ord(c) < 32 or ord(c) == 127 for c in arg)
+
+
+class ResponseCache(object):
+    """Rendered pages by url, every page is kept for cachetime seconds"""
+
+    def __init__(self, cachetime, maxsize=1000):
+        self.cachetime = cachetime
+        self.pages = LRUCache(maxsize)
+
+    def get(self, url):
+        page = self.pages.get(url)
+        if page and page[0] > time.monotonic():
+            return page[1]
+        return None
+
+    def put(self, url, body):
+        if self.cachetime > 0:
+            self.pages.put(url, (time.monotonic() + self.cachetime, body))
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, don't let them wait for the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def route(self, path, query):
+        """Returns the output generator for path, these are the links the Html output uses"""
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+        if len(parts) != 2 or not validarg(parts[1]):
+            return None
+        statstype = query.get('statstype', [self.server.statstype])[0]
+        if statstype not in ('ranked', 'public', 'casual'):
+            return None
+        command, arg = parts
+        outputobj = self.server.outputobj
+        if command == 'player':
+            return outputobj.playerinfo([arg], statstype)
+        if command == 'matches':
+            limit = int(query['limit'][0]) if query.get('limit', [''])[0].isdigit() else self.server.limit
+            return outputobj.matchesinfo([arg], statstype, limit)
+        if command == 'match' and arg.isdigit():
+            return outputobj.matchinfo([int(arg)])
+        return None
+
+    def do_GET(self):
+        body = self.server.cache.get(self.path)
+        if body is None:
+            url = urllib.parse.urlsplit(self.path)
+            try:
+                output = self.route(url.path, urllib.parse.parse_qs(url.query))
+                if output is None:
+                    return self.senderror(404, 'Not found')
+                body = ''.join(output).encode('utf-8')
+            except NoResultsError:
+                return self.senderror(404, 'No results')
+            except Exception as e:
+                self.log_error("%s: %s", type(e).__name__, e)
+                return self.senderror(500, 'Internal error')
+            self.server.cache.put(self.path, body)
+        self.send(200, body)
+
+    def send_error(self, code, message=None, explain=None):
+        """Used by BaseHTTPRequestHandler for bad requests and unsupported methods. Its own version needs
+           the html module of the standard library, which the html module of honstats shadows."""
+        # a request that wasn't understood may have left a body unread
+        self.close_connection = True
+        self.senderror(code, message or self.responses.get(code, ('Error',))[0])
+
+    def senderror(self, code, message):
+        self.send(code, '<html><body><h1>{code} {message}</h1></body></html>'.format(
+            code=code, message=escape(message)).encode('utf-8'))
+
+    def send(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if getattr(self, 'command', None) != 'HEAD':
+            self.wfile.write(body)
+
+
+class HonstatsServer(ThreadingHTTPServer):
+    """Serves the Html output, all request threads share the data provider and its caches"""
+    daemon_threads = True
+
+    def __init__(self, address, outputobj, statstype='ranked', limit=None, cachetime=60, quiet=False):
+        ThreadingHTTPServer.__init__(self, address, RequestHandler)
+        self.outputobj = outputobj
+        self.statstype = statstype
+        self.limit = limit
+        self.cache = ResponseCache(cachetime)
+        self.quiet = quiet
+
+
+def serve(outputobj, host='127.0.0.1', port=8080, **kwargs):
+    server = HonstatsServer((host, port), outputobj, **kwargs)
+    sys.stderr.write("honstats serving on http://{host}:{port}/\n".format(host=host, port=server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
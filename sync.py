@@ -0,0 +1,64 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import re
+import time
+
+DefaultInterval = 300
+
+
+def parselist(value):
+    """Splits a config value separated by commas or whitespace, like the watch-list of players"""
+    return [item for item in re.split(r"[\s,]+", value) if item]
+
+
+def syncplayer(dp, player, statstypes, depth=0):
+    """Refreshes the stats and history of a player and downloads all matches that aren't cached yet.
+       depth limits the download to the newest matches, 0 downloads the whole history.
+
+       Returns:
+         tuple of (new matches in the history, downloaded matches)
+    """
+    new = 0
+    downloaded = 0
+    for statstype in statstypes:
+        dp.fetchplayer(player, statstype)
+        new += len(dp.synchistory(player, statstype))
+        matchids = dp.matches(player, statstype)
+        if depth:
+            matchids = matchids[:depth]
+        cached = dp.matchstore.cachedids(matchids)
+        for matchid, matchdata in dp.itermatchdata([matchid for matchid in matchids if matchid not in cached]):
+            if matchdata:
+                downloaded += 1
+    return new, downloaded
+
+
+def sync(dp, players, statstypes, interval=DefaultInterval, depth=0, once=False):
+    """Syncs all players every interval seconds, yields a status line per player.
+       Failing players are reported and retried in the next round."""
+    while True:
+        start = time.monotonic()
+        for player in players:
+            try:
+                new, downloaded = syncplayer(dp, player, statstypes, depth)
+                yield "{player}: {new} new matches, {downloaded} downloaded\n".format(
+                    player=player, new=new, downloaded=downloaded)
+            except Exception as e:
+                yield "{player}: sync failed: {error}\n".format(player=player, error=str(e) or type(e).__name__)
+        if once:
+            return
+        time.sleep(max(0.0, interval - (time.monotonic() - start)))
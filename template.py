@@ -0,0 +1,61 @@
+"""
+This file is part of honstats.
+
+honstats is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+honstats is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with honstats.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import threading
+import time
+from string import Template
+
+DefaultDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+class TemplateCache(object):
+    """Loads <name>.tmpl files from a directory once and keeps the compiled templates.
+       A template is reloaded if its mtime changed, mtimes are checked at most every CheckInterval seconds."""
+
+    CheckInterval = 1.0
+
+    def __init__(self, directory=None):
+        self.directory = os.path.expanduser(directory) if directory else DefaultDirectory
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.templates.get(name)
+            if cached and now - cached['checked'] < TemplateCache.CheckInterval:
+                return cached['template']
+
+            path = os.path.join(self.directory, name + '.tmpl')
+            mtime = os.stat(path).st_mtime_ns
+            if not cached or cached['mtime'] != mtime:
+                with open(path, 'r') as f:
+                    cached = {'template': Template(f.read()), 'mtime': mtime}
+                self.templates[name] = cached
+            cached['checked'] = now
+            return cached['template']
+
+
+_caches = {}
+
+
+def templatecache(directory=None):
+    """Returns the process wide TemplateCache for directory"""
+    directory = directory if directory else DefaultDirectory
+    if directory not in _caches:
+        _caches[directory] = TemplateCache(directory)
+    return _caches[directory]
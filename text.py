@@ -18,141 +18,117 @@ along with honstats.  If not, see <http://www.gnu.org/licenses/>.
 """
 __author__ = 'rp'
 
-import datetime
+from concurrent.futures import ThreadPoolExecutor
 
+import aggregate
 from data import Player, Match, Hero
 
 
 class Text():
 
-    def __init__(self, dp):
+    def __init__(self, dp, jobs=1):
         self.dp = dp
+        self.jobs = jobs
+
+    def forplayers(self, ids, func, *args):
+        """Yields the output of func(id_, *args) for every player in the order of ids.
+           With more than one job the players are processed concurrently, the output
+           of a player is yielded once it and the output of all players before it are done."""
+        if self.jobs > 1 and len(ids) > 1:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for chunks in executor.map(lambda id_: list(func(id_, *args)), ids):
+                    yield from chunks
+        else:
+            for id_ in ids:
+                yield from func(id_, *args)
 
     def playerinfo(self, ids, statstype):
-        output = Player.header() + '\n'
-
-        for id_ in ids:
-            #print(url)
-            data = self.dp.fetchplayer(id_, statstype)
-            nickname = self.dp.id2nick(int(data['account_id']))
-            player = Player(nickname, data)
-            #print(json.dumps(data))
-            output += player.str() + '\n'
-        return output
-
-    @classmethod
-    def initavgdata(cls):
-        avgdata = {'mid': 0,
-                   'gt': "--",
-                   'gd': datetime.timedelta(),
-                   'date': '',
-                   'k': 0,
-                   'd': 0,
-                   'a': 0,
-                   'kdr': 0,
-                   'hero': '',
-                   'wl': '-',
-                   'wa': 0,
-                   'ck': 0,
-                   'cd': 0,
-                   'gpm': 0}
-        return avgdata
-
-    @classmethod
-    def fillavgdata(cls, avgdata, matchdata):
-        avgdata['gd'] += matchdata['gd']
-        avgdata['k'] += matchdata['k']
-        avgdata['d'] += matchdata['d']
-        avgdata['a'] += matchdata['a']
-        avgdata['wa'] += matchdata['wa']
-        avgdata['ck'] += matchdata['ck']
-        avgdata['cd'] += matchdata['cd']
-        avgdata['gpm'] += matchdata['gpm']
-        return avgdata
+        yield Player.header() + '\n'
+        yield from self.forplayers(ids, self.playerinfoplayer, statstype)
+
+    def playerinfoplayer(self, id_, statstype):
+        #print(url)
+        data = self.dp.fetchplayer(id_, statstype)
+        nickname = self.dp.id2nick(int(data['account_id']))
+        player = Player(nickname, data)
+        #print(json.dumps(data))
+        yield player.str() + '\n'
+
+    @staticmethod
+    def avgrow(data):
+        """The AverageFields of the matchesdata of a match, only these are kept for the averages"""
+        return (int(data['gd'].total_seconds()), data['k'], data['d'], data['a'], data['wa'], data['ck'], data['cd'],
+                data['gpm'])
 
     @classmethod
-    def finalizeavgdata(cls, avgdata, limit):
-        avgdata['gd'] = str(avgdata['gd'] / limit)[:4]
-        avgdata['k'] = int(avgdata['k'] / limit)
-        avgdata['d'] = int(avgdata['d'] / limit)
-        avgdata['a'] = int(avgdata['a'] / limit)
-        avgdata['kdr'] = avgdata['k'] / avgdata['d']
-        avgdata['wa'] = int(avgdata['wa'] / limit)
-        avgdata['ck'] = int(avgdata['ck'] / limit)
-        avgdata['cd'] = int(avgdata['cd'] / limit)
-        avgdata['gpm'] = int(avgdata['gpm'] / limit)
+    def avgdata(cls, rows, count):
+        """Averages of the avgrow tuples of a player's matches in the format of Match.MatchesFormat"""
+        columns = aggregate.Columns(aggregate.AverageFields, rows)
+        avgdata = {'mid': 0, 'gt': "--", 'date': '', 'hero': '', 'wl': '-'}
+        avgdata.update(aggregate.averages(columns, count))
         return avgdata
 
     def matchesinfo(self, ids, statstype, limit):
-        output = ''
-        for id_ in ids:
-            matchids = self.dp.matches(id_, statstype)
-            avgdata = Text.initavgdata()
-            limit = min(limit, len(matchids)) if limit else len(matchids)
-            output += self.dp.id2nick(id_) + '\n'
-            output += Match.headermatches() + '\n'
-            for i in range(limit):
-                matches = self.dp.fetchmatchdata([matchids[i]])
-                match = Match.creatematch(matchids[i], matches[matchids[i]])
-
-                # count average
-                if isinstance(match, Match):
-                    matchdata = match.matchesdata(self.dp.nick2id(id_), self.dp)
-                    avgdata = Text.fillavgdata(avgdata, matchdata)
-                output += match.matchesstr(self.dp.nick2id(id_), self.dp) + '\n'
-            avgdata = Text.finalizeavgdata(avgdata, limit)
-            output += "average   " + Match.MatchesFormat.format(**avgdata)[10:] + '\n'
-            #print(json.dumps(history))
-        return output
+        yield from self.forplayers(ids, self.matchesinfoplayer, statstype, limit)
+
+    def matchesinfoplayer(self, id_, statstype, limit):
+        matchids = self.dp.matches(id_, statstype)
+        rows = []
+        limit = min(limit, len(matchids)) if limit else len(matchids)
+        aid = self.dp.nick2id(id_)
+        yield self.dp.id2nick(id_) + '\n'
+        yield Match.headermatches() + '\n'
+        for mid, data in self.dp.itermatchdata(matchids[:limit], player=aid):
+            match = Match.creatematch(mid, data)
+
+            # count average
+            if isinstance(match, Match):
+                rows.append(Text.avgrow(match.matchesdata(aid, self.dp)))
+            yield match.matchesstr(aid, self.dp) + '\n'
+        avgdata = Text.avgdata(rows, limit)
+        yield "average   " + Match.MatchesFormat.format(**avgdata)[10:] + '\n'
+        #print(json.dumps(history))
 
     def matchinfo(self, ids):
-        matches = self.dp.fetchmatchdata(ids)
-        output = ''
-        for mid in ids:
-            match = Match.creatematch(mid, matches[mid])
-            output += match.matchstr(self.dp) + '\n'
-        return output
+        for mid, data in self.dp.itermatchdata(ids):
+            match = Match.creatematch(mid, data)
+            yield match.matchstr(self.dp) + '\n'
 
     def playerheroesinfo(self, ids, statstype, sort_by, order, arglimit):
-        output = ''
-        for id_ in ids:
-            data = self.dp.fetchplayer(id_, statstype)
-            nickname = self.dp.id2nick(int(data['account_id']))
-            player = Player(nickname, data)
-            stats = player.playerheroes(self.dp, statstype, sort_by, order)
-
-            limit = arglimit if arglimit else len(stats)
-            output += self.dp.id2nick(id_) + '\n'
-            output += Player.PlayerHeroHeader + '\n'
-            for i in range(limit):
-                stat = stats[i]
-                stat['hero'] = self.dp.heroid2name(stat['heroid'])[:10]
-                output += Player.PlayerHeroFormat.format(**stat) + '\n'
-
-        return output
+        yield from self.forplayers(ids, self.playerheroesinfoplayer, statstype, sort_by, order, arglimit)
+
+    def playerheroesinfoplayer(self, id_, statstype, sort_by, order, arglimit):
+        data = self.dp.fetchplayer(id_, statstype)
+        nickname = self.dp.id2nick(int(data['account_id']))
+        player = Player(nickname, data)
+        stats = player.playerheroes(self.dp, statstype, sort_by, order)
+
+        limit = arglimit if arglimit else len(stats)
+        yield self.dp.id2nick(id_) + '\n'
+        yield Player.PlayerHeroHeader + '\n'
+        for i in range(limit):
+            stat = stats[i]
+            stat['hero'] = self.dp.heroid2name(stat['heroid'])[:10]
+            yield Player.PlayerHeroFormat.format(**stat) + '\n'
 
     def lastmatchesinfo(self, ids, statstype, hero, arglimit, count):
-        output = ''
-        for id_ in ids:
-            id_hero = (id_, hero) if hero else None
-            matchids = self.dp.matches(id_, statstype)
-            limit = arglimit if (arglimit or count) < count else count
-            matches = self.dp.fetchmatchdata(matchids, limit=limit, id_hero=id_hero)
-            output += self.dp.id2nick(id_) + '\n'
-            for mid in sorted(matches.keys(), reverse=True):
-                match = Match.creatematch(mid, matches[mid])
-                output += match.matchstr(self.dp) + '\n'
-
-        return output
+        yield from self.forplayers(ids, self.lastmatchesinfoplayer, statstype, hero, arglimit, count)
+
+    def lastmatchesinfoplayer(self, id_, statstype, hero, arglimit, count):
+        id_hero = (id_, hero) if hero else None
+        matchids = self.dp.matches(id_, statstype)
+        limit = arglimit if (arglimit or count) < count else count
+        matches = self.dp.fetchmatchdata(matchids, limit=limit, id_hero=id_hero)
+        yield self.dp.id2nick(id_) + '\n'
+        for mid in sorted(matches.keys(), reverse=True):
+            match = Match.creatematch(mid, matches[mid])
+            yield match.matchstr(self.dp) + '\n'
 
     def heroesinfo(self, arglimit):
-        output = ''
         heroesdata = self.dp.heroes()
         heroids = list(heroesdata.keys())
         heroids.sort(key=int)
         limit = arglimit if arglimit else len(heroids)
         for heroidindex in range(limit):
             hero = Hero(heroesdata[heroids[heroidindex]])
-            output += hero.herostr() + '\n'
-
-        return output
+            yield hero.herostr() + '\n'